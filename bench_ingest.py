@@ -0,0 +1,118 @@
+"""
+Benchmark concurrent webhook ingest throughput
+
+Compares the old inline persistence (SQLAlchemy commit on the event loop),
+one commit per request on the DB executor, and the group-commit writer used
+by receive_webhook. A per-commit delay can be injected to simulate the
+disk/network fsync latency of a real database.
+
+Usage:
+    python bench_ingest.py --requests 500 --concurrency 50 --commit-latency-ms 2
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+
+# Use a throwaway SQLite database; must be set before config is imported
+_tmpdir = tempfile.mkdtemp(prefix="bench_ingest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir}/bench.db"
+os.environ.setdefault("DEFAULT_RATE_LIMIT", "1000000")
+os.environ.setdefault("MAX_RATE_LIMIT", "1000000")
+# Every mode sends the same bodies, so duplicate suppression would answer
+# all but the first mode without touching the database
+os.environ["IDEMPOTENCY_ENABLED"] = "false"
+
+import httpx
+from sqlalchemy import event
+
+from config import settings
+from db import database
+from db.batch_writer import ingest_writer
+from main import app
+from routes import webhook_routes
+
+def sign(body: bytes) -> str:
+    digest = hmac.new(settings.WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+def _insert_one(db, webhook_event) -> int:
+    db.add(webhook_event)
+    db.flush()
+    event_id = webhook_event.id
+    db.commit()
+    return event_id
+
+class InlineWriter:
+    """Original behaviour: commit each event directly on the event loop"""
+    async def submit(self, webhook_event):
+        return database._call_with_session(_insert_one, webhook_event), True
+
+class ExecutorWriter:
+    """One commit per event, run on the DB executor"""
+    async def submit(self, webhook_event):
+        return await database.run_in_session(_insert_one, webhook_event), True
+
+async def run_load(writer, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def send(i: int):
+            body = json.dumps({"type": "bench.event", "data": {"n": i}}).encode("utf-8")
+            headers = {
+                "Content-Type": "application/json",
+                "X-Signature": sign(body),
+                "X-Tenant-ID": f"tenant-{i % 20}"
+            }
+            async with semaphore:
+                response = await client.post("/webhook", content=body, headers=headers)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    if writer is ingest_writer:
+        await ingest_writer.stop()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--commit-latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    database.init_db()
+
+    if args.commit_latency_ms > 0:
+        # Sleep after the commit so SQLite's write lock is not held while
+        # waiting, approximating a networked database's round-trip/fsync time
+        @event.listens_for(database.SessionLocal, "after_commit")
+        def _slow_commit(session):
+            time.sleep(args.commit_latency_ms / 1000)
+
+    modes = (
+        ("inline", InlineWriter()),
+        ("executor", ExecutorWriter()),
+        ("group commit", ingest_writer),
+    )
+    results = {}
+    for mode, writer in modes:
+        webhook_routes.ingest_writer = writer
+        results[mode] = asyncio.run(run_load(writer, args.requests, args.concurrency))
+    webhook_routes.ingest_writer = ingest_writer
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"commit latency {args.commit_latency_ms}ms, {settings.DB_EXECUTOR_WORKERS} DB threads, "
+          f"batch {settings.INGEST_BATCH_MAX_SIZE}/{settings.INGEST_BATCH_MAX_WAIT_MS}ms")
+    for mode, elapsed in results.items():
+        print(f"  {mode:<14} {elapsed:7.3f}s  {args.requests / elapsed:9.1f} req/s")
+
+if __name__ == "__main__":
+    main()
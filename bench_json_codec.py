@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of the available JSON codec backends
+
+Times decoding a webhook body and encoding it again (forwarding, JSON column)
+for every backend importable in this environment.
+
+Usage:
+    python bench_json_codec.py --iterations 20000
+"""
+import argparse
+import json
+import timeit
+
+from controllers import json_codec
+
+SAMPLE = {
+    "type": "payment.completed",
+    "id": "evt_1NqZ3L2eZvKYlo2C",
+    "created": 1700000000,
+    "livemode": False,
+    "data": {
+        "object": {
+            "id": "pay_3NqZ3L2eZvKYlo2C0xyz",
+            "amount": 2599,
+            "currency": "usd",
+            "customer": {"id": "cus_9s6XKzkNRiz8i3", "email": "jane@example.com", "name": "Jane Doe"},
+            "metadata": {"order_id": "order-7781", "channel": "web", "note": "café ☕"},
+            "items": [
+                {"sku": f"sku-{n}", "qty": n % 3 + 1, "price": 199 + n, "tags": ["a", "b", "c"]}
+                for n in range(20)
+            ],
+        }
+    },
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    body = json.dumps(SAMPLE).encode("utf-8")
+    print(f"payload {len(body)} bytes, {args.iterations} iterations, active backend: {json_codec.backend}")
+
+    for name, factory in json_codec._BACKENDS.items():
+        try:
+            loads, dumps, _ = factory()
+        except ImportError:
+            print(f"  {name:<8} not installed")
+            continue
+        decoded = loads(body)
+        t_loads = timeit.timeit(lambda: loads(body), number=args.iterations)
+        t_dumps = timeit.timeit(lambda: dumps(decoded), number=args.iterations)
+        per = 1e6 / args.iterations
+        print(f"  {name:<8} loads {t_loads * per:7.2f} us   dumps {t_dumps * per:7.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the rate limiter at high tenant counts
+
+Compares the previous timestamp-list sliding window with the GCRA limiter
+in controllers/rate_limiter.py: time per check and memory held per tenant.
+
+Usage:
+    python bench_rate_limiter.py --tenants 10000 --checks 200000 --limit 50
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+import config
+
+class SlidingWindowLimiter:
+    """The previous implementation: a list of request timestamps per tenant"""
+    def __init__(self):
+        self.requests = defaultdict(list)
+
+    def check_rate_limit(self, tenant_id: str, limit: int, window: int = 1):
+        now = time.time()
+        cutoff = now - window
+        tenant_requests = [ts for ts in self.requests[tenant_id] if ts > cutoff]
+        if len(tenant_requests) >= limit:
+            return False, 0
+        tenant_requests.append(now)
+        self.requests[tenant_id] = tenant_requests
+        return True, limit - len(tenant_requests)
+
+def run(limiter, tenants, checks: int, limit: int) -> float:
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.check_rate_limit(tenants[i % len(tenants)], limit)
+    return time.perf_counter() - start
+
+def state_size(limiter_class, tenants, limit: int) -> int:
+    """Memory held after every tenant has used its full limit"""
+    tracemalloc.start()
+    limiter = limiter_class()
+    for tenant_id in tenants:
+        for _ in range(limit):
+            limiter.check_rate_limit(tenant_id, limit)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tenants", type=int, default=10000)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    config.settings.MAX_RATE_LIMIT = max(config.settings.MAX_RATE_LIMIT, args.limit)
+    from controllers.rate_limiter import RateLimiter
+
+    tenants = [f"tenant-{n}" for n in range(args.tenants)]
+    random.shuffle(tenants)
+
+    print(f"{args.tenants} tenants, {args.checks} checks, limit {args.limit}/s")
+    # Freeze the clock inside the window so every tenant stays at its limit,
+    # the steady state of a busy gateway (perf_counter is unaffected)
+    frozen = time.time()
+    time.time = lambda: frozen
+
+    for name, limiter_class in (("sliding window", SlidingWindowLimiter), ("gcra", RateLimiter)):
+        # Warm every tenant up to its limit first, as in steady state under load
+        limiter = limiter_class()
+        for tenant_id in tenants:
+            for _ in range(args.limit):
+                limiter.check_rate_limit(tenant_id, args.limit)
+        elapsed = run(limiter, tenants, args.checks, args.limit)
+        memory = state_size(limiter_class, tenants, args.limit)
+        print(f"  {name:<15} {elapsed / args.checks * 1e6:7.2f} us/check  "
+              f"{memory / args.tenants:8.1f} bytes/tenant")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import field_validator, Field
+from typing import Dict, List
 import os
 import sys
 
@@ -28,20 +29,155 @@ class Settings(BaseSettings):
     # Database connection URL (computed from _get_database_url)
     DATABASE_URL: str = Field(default_factory=_get_database_url)
 
+    # Size of the thread pool that runs blocking database calls off the event loop
+    DB_EXECUTOR_WORKERS: int = 8
+
+    # Ingest group commit: accepted webhooks are inserted together once a batch
+    # fills up or the first one has waited this long
+    INGEST_BATCH_MAX_SIZE: int = 100
+    INGEST_BATCH_MAX_WAIT_MS: int = 5
+    # "direct" inserts each webhook before acknowledging it; "log" acknowledges
+    # once it is fsynced to an append-only log under INGEST_LOG_DIR and loads
+    # the log into the database in the background
+    INGEST_MODE: str = "direct"
+    INGEST_LOG_DIR: str = "./ingest_log"
+    INGEST_LOG_SEGMENT_BYTES: int = 16 * 1024 * 1024
+    INGEST_LOG_FSYNC_MS: int = 2
+    INGEST_LOG_LOAD_BATCH: int = 500
+    INGEST_LOG_LOAD_RETRY_SECONDS: int = 5
+
     # Webhook Settings
     WEBHOOK_SECRET: str = "your-secret-key-change-this"
     INTERNAL_WEBHOOK_URL: str = "https://webhook-relay-validation-gateway-full-production.up.railway.app/internal/webhook"
+    # Per-tenant signing secrets, keyed by X-Tenant-ID: "none" (everyone uses
+    # WEBHOOK_SECRET), "file" (JSON/YAML mapping tenant -> secret or list of
+    # secrets) or "db" (active rows of tenant_secrets). Unknown tenants fall
+    # back to WEBHOOK_SECRET. Reloaded periodically so rotations need no restart.
+    TENANT_SECRETS_SOURCE: str = "none"
+    TENANT_SECRETS_FILE: str = "tenant_secrets.yaml"
+    TENANT_SECRETS_REFRESH_SECONDS: int = 60
+    HMAC_KEY_CACHE_SIZE: int = 4096  # Pre-keyed HMAC objects kept in the LRU
+    # Outbound signing: when OUTBOUND_SIGNING_SECRET is set, deliveries carry
+    # OUTBOUND_SIGNATURE_HEADER: "sha256=<hex HMAC of the forwarded body>"
+    OUTBOUND_SIGNING_SECRET: str = ""
+    OUTBOUND_SIGNATURE_HEADER: str = "X-Gateway-Signature"
+    # Original request headers stored with each event and sent on delivery
+    FORWARD_HEADERS: List[str] = ["Content-Type", "Idempotency-Key", "X-Event-ID", "Webhook-Id"]
+    # Also persist the parsed payload in the JSON column (raw body is always stored)
+    STORE_PARSED_PAYLOAD: bool = False
+    # Largest accepted webhook body, with optional per-tenant overrides
+    # (TENANT_MAX_BODY_BYTES is a JSON object: {"tenant-id": bytes})
+    MAX_BODY_BYTES: int = 1024 * 1024
+    TENANT_MAX_BODY_BYTES: Dict[str, int] = {}
+
+    # Duplicate suppression: a delivery is identified by the first of these
+    # headers that is present, else (optionally) by a hash of its raw body.
+    # Recent keys are cached in memory; a unique index catches the rest.
+    # The index is permanent, so with IDEMPOTENCY_HASH_BODY a tenant's
+    # byte-identical events (e.g. repeated pings) are dropped forever, not
+    # just within the TTL; only enable it for senders whose bodies are unique.
+    IDEMPOTENCY_ENABLED: bool = True
+    IDEMPOTENCY_HEADERS: List[str] = ["Idempotency-Key", "X-Event-ID", "Webhook-Id"]
+    IDEMPOTENCY_HASH_BODY: bool = False
+    IDEMPOTENCY_CACHE_SIZE: int = 100000
+    IDEMPOTENCY_TTL_SECONDS: int = 3600
+
+    # JSON backend: auto (orjson > msgspec > stdlib), orjson, msgspec or stdlib
+    JSON_CODEC: str = "auto"
 
     # Rate Limiting
     DEFAULT_RATE_LIMIT: int = 10  # events per second per tenant
     MAX_RATE_LIMIT: int = 50
+    DEFAULT_RATE_BURST: int = 0  # requests allowed at once; 0 = same as the limit
+    # Per-tenant overrides, JSON objects: {"tenant-id": value}
+    TENANT_RATE_LIMITS: Dict[str, int] = {}
+    TENANT_RATE_BURSTS: Dict[str, int] = {}
+    # Where limiter state lives: "memory" (per process) or "sqlite" (a local
+    # file shared by all uvicorn workers on the host, so limits stay exact)
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_SQLITE_PATH: str = "./rate_limits.db"
+    # Idle tenants are expired a few per request; the in-memory store also
+    # drops its least recently seen tenants beyond the cap
+    RATE_LIMIT_EVICTIONS_PER_CHECK: int = 2
+    RATE_LIMIT_MAX_TENANTS: int = 100000
+
+    # Admission control: once pending + processing events reach these marks,
+    # /webhook answers 503 with a Retry-After estimated from the drain rate
+    # (0 disables a mark; TENANT_MAX_BACKLOG is a JSON object of overrides)
+    ADMISSION_MAX_BACKLOG: int = 100000
+    ADMISSION_MAX_TENANT_BACKLOG: int = 20000
+    TENANT_MAX_BACKLOG: Dict[str, int] = {}
+    ADMISSION_RESYNC_SECONDS: int = 5
+    ADMISSION_MAX_RETRY_AFTER: int = 300
 
     # Retry Settings
     MAX_RETRY_ATTEMPTS: int = 8
     INITIAL_RETRY_DELAY: int = 1  # seconds
+    MAX_RETRY_DELAY: int = 300  # seconds; also caps a destination's Retry-After
+    # Backoff jitter: "none" (plain exponential), "full" (random up to the
+    # exponential delay) or "decorrelated" (random up to 3x the last delay).
+    # A Retry-After on a 429/503 response is waited out before the next attempt.
+    RETRY_JITTER: str = "full"
+    # Overrides keyed by internal_url and by tenant (tenant wins), JSON objects:
+    # {"key": {"base": 5, "cap": 600, "jitter": "decorrelated", "max_attempts": 12}}
+    RETRY_POLICY_DESTINATIONS: Dict[str, dict] = {}
+    RETRY_POLICY_TENANTS: Dict[str, dict] = {}
 
     # Worker Settings
     WORKER_POLL_INTERVAL: int = 2  # seconds between polling for pending events
+    # Run the delivery worker inside the API process. Disable when delivery
+    # runs separately (python -m workers), which starts WORKER_PROCESSES
+    # processes; standalone workers find new events at their poll interval
+    EMBEDDED_WORKER: bool = True
+    WORKER_PROCESSES: int = 1
+    WORKER_MAX_IN_FLIGHT: int = 50  # deliveries running at once per worker process
+    WORKER_LEASE_SECONDS: int = 120  # how long a claimed event belongs to its worker
+    WORKER_HEARTBEAT_SECONDS: int = 30  # how often in-flight leases are extended
+    WORKER_REAP_INTERVAL: int = 30  # how often expired leases go back to pending
+    WORKER_DRAIN_SECONDS: int = 20  # shutdown wait for in-flight deliveries before releasing them
+    # Fair scheduling across tenants: slots are shared in proportion to
+    # TENANT_WEIGHTS (JSON object, default weight 1), and a tenant never has
+    # more than its cap in flight (TENANT_MAX_IN_FLIGHT overrides; 0 = no cap)
+    WORKER_TENANT_MAX_IN_FLIGHT: int = 0
+    TENANT_MAX_IN_FLIGHT: Dict[str, int] = {}
+    TENANT_WEIGHTS: Dict[str, float] = {}
+
+    # Destination HTTP pools (one per internal_url origin). DEST_HTTP2 needs
+    # httpx[http2]; DEST_WARM_URLS are connected at startup in addition to
+    # INTERNAL_WEBHOOK_URL (JSON list)
+    DEST_MAX_CONNECTIONS: int = 100
+    DEST_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    DEST_KEEPALIVE_EXPIRY: float = 30.0  # seconds an idle connection is kept
+    DEST_HTTP2: bool = False
+    DEST_CONNECT_TIMEOUT: float = 5.0
+    DEST_READ_TIMEOUT: float = 30.0
+    DEST_WRITE_TIMEOUT: float = 10.0
+    DEST_POOL_TIMEOUT: float = 5.0  # wait for a free connection in the pool
+    DEST_WARM_URLS: List[str] = []
+    # Destination responses are read only up to DELIVERY_RESPONSE_MAX_BYTES
+    # (the rest is never downloaded or decoded) and stored with the attempt;
+    # successful attempts can skip storing it
+    DELIVERY_RESPONSE_MAX_BYTES: int = 1000
+    STORE_SUCCESS_RESPONSE_BODY: bool = True
+
+    # Batched delivery: events for these internal_urls (JSON list) are sent as
+    # a JSON array of payloads, up to BATCH_DELIVERY_MAX_EVENTS per request or
+    # whatever arrived within BATCH_DELIVERY_MAX_WAIT_MS of the first
+    BATCH_DELIVERY_URLS: List[str] = []
+    BATCH_DELIVERY_MAX_EVENTS: int = 50
+    BATCH_DELIVERY_MAX_WAIT_MS: int = 20
+    # Largest 2xx batch response read for its per-event results
+    BATCH_DELIVERY_RESULTS_MAX_BYTES: int = 1024 * 1024
+
+    # Circuit breaker per internal_url: opens when CIRCUIT_FAILURE_RATE of the
+    # last CIRCUIT_WINDOW_SIZE attempts (at least CIRCUIT_MIN_REQUESTS) failed
+    # with a connection error or 5xx, then pauses that destination for
+    # CIRCUIT_OPEN_SECONDS before a single probe delivery
+    CIRCUIT_BREAKER_ENABLED: bool = True
+    CIRCUIT_WINDOW_SIZE: int = 20
+    CIRCUIT_MIN_REQUESTS: int = 10
+    CIRCUIT_FAILURE_RATE: float = 0.5
+    CIRCUIT_OPEN_SECONDS: int = 30
 
     class Config:
         env_file = ".env"
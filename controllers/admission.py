@@ -0,0 +1,141 @@
+"""
+Backlog-aware admission control
+Sheds new webhooks with 503 + Retry-After while the delivery backlog is too deep
+"""
+import asyncio
+import math
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.database import run_in_session
+from models.webhook_models import WebhookEvent
+from config import settings
+
+BACKLOG_STATUSES = ("pending", "processing")
+
+class AdmissionDecision(NamedTuple):
+    admitted: bool
+    retry_after: int  # seconds, 0 if admitted
+    reason: str
+
+def _count_backlog(db: Session, after_id: Optional[int]) -> Tuple[Dict[str, int], int, Optional[int]]:
+    """
+    Pending + processing events per tenant, and the events inserted since after_id
+
+    Returns:
+        (backlog per tenant, rows with id > after_id, highest event id)
+    """
+    rows = db.query(WebhookEvent.tenant_id, func.count(WebhookEvent.id)).filter(
+        WebhookEvent.status.in_(BACKLOG_STATUSES)
+    ).group_by(WebhookEvent.tenant_id).all()
+    new_rows, max_id = db.query(func.count(WebhookEvent.id), func.max(WebhookEvent.id)).filter(
+        WebhookEvent.id > (after_id or 0)
+    ).one()
+    return {tenant_id or "default": count for tenant_id, count in rows}, new_rows, max_id or after_id
+
+class AdmissionController:
+    """
+    Tracks the delivery backlog in memory and decides whether to accept more
+    
+    Counts are adjusted as this process accepts and finishes events, and
+    resynchronized from the database every ADMISSION_RESYNC_SECONDS to absorb
+    other processes and replays. The same tick measures the drain rate
+    (events finished per second, smoothed) from the database: the previous
+    backlog plus events inserted since, minus the current backlog. It
+    therefore counts every worker process, including standalone ones, and
+    turns the excess backlog into a Retry-After estimate for rejected requests.
+    """
+    def __init__(self):
+        self.backlog = 0
+        self.tenant_backlog: Dict[str, int] = {}
+        self.drain_rate = 0.0  # events/sec, exponentially smoothed
+        # Database backlog and highest event id at the last resync
+        self._synced_backlog: Optional[int] = None
+        self._synced_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+    
+    def _tenant_limit(self, tenant_id: str) -> int:
+        return settings.TENANT_MAX_BACKLOG.get(tenant_id, settings.ADMISSION_MAX_TENANT_BACKLOG)
+    
+    def _retry_after(self, excess: float, drain_rate: float) -> int:
+        """Seconds until `excess` events should have drained"""
+        if drain_rate <= 0:
+            return settings.ADMISSION_MAX_RETRY_AFTER
+        seconds = math.ceil(excess / drain_rate)
+        return max(1, min(seconds, settings.ADMISSION_MAX_RETRY_AFTER))
+    
+    def check(self, tenant_id: str) -> AdmissionDecision:
+        """Decide whether to accept one more event for a tenant"""
+        global_limit = settings.ADMISSION_MAX_BACKLOG
+        if global_limit and self.backlog >= global_limit:
+            # Ask callers to come back once we're 10% under the mark
+            excess = self.backlog - global_limit * 0.9
+            return AdmissionDecision(False, self._retry_after(excess, self.drain_rate), "Gateway backlog full")
+        
+        tenant_limit = self._tenant_limit(tenant_id)
+        tenant_backlog = self.tenant_backlog.get(tenant_id, 0)
+        if tenant_limit and tenant_backlog >= tenant_limit:
+            # Assume the tenant drains at its share of the overall rate
+            share = tenant_backlog / self.backlog if self.backlog else 0
+            excess = tenant_backlog - tenant_limit * 0.9
+            return AdmissionDecision(
+                False, self._retry_after(excess, self.drain_rate * share), "Tenant backlog full"
+            )
+        
+        return AdmissionDecision(True, 0, "")
+    
+    def record_accepted(self, tenant_id: str, count: int = 1):
+        self.backlog += count
+        self.tenant_backlog[tenant_id] = self.tenant_backlog.get(tenant_id, 0) + count
+    
+    def record_completed(self, tenant_id: str, count: int = 1):
+        """An event left the backlog (delivered or dead-lettered)"""
+        self.backlog = max(0, self.backlog - count)
+        remaining = self.tenant_backlog.get(tenant_id, 0) - count
+        if remaining > 0:
+            self.tenant_backlog[tenant_id] = remaining
+        else:
+            self.tenant_backlog.pop(tenant_id, None)
+    
+    async def resync(self):
+        """Replace in-memory counts with the database's and update the drain rate"""
+        counts, inserted, max_id = await run_in_session(_count_backlog, self._synced_id)
+        self.tenant_backlog = counts
+        self.backlog = sum(counts.values())
+        
+        now = time.monotonic()
+        elapsed = now - self._last_tick
+        if self._synced_backlog is not None and elapsed > 0:
+            completed = max(0, self._synced_backlog + inserted - self.backlog)
+            sample = completed / elapsed
+            self.drain_rate = sample if self.drain_rate == 0 else 0.7 * self.drain_rate + 0.3 * sample
+        self._synced_backlog = self.backlog
+        self._synced_id = max_id
+        self._last_tick = now
+    
+    async def resync_loop(self):
+        while True:
+            await asyncio.sleep(settings.ADMISSION_RESYNC_SECONDS)
+            try:
+                await self.resync()
+            except Exception as e:
+                print(f"Admission resync error: {e}")
+    
+    def snapshot(self, top: int = 20) -> dict:
+        """Current backlog, limits and the busiest tenants"""
+        busiest = sorted(self.tenant_backlog.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "backlog": self.backlog,
+            "max_backlog": settings.ADMISSION_MAX_BACKLOG,
+            "max_tenant_backlog": settings.ADMISSION_MAX_TENANT_BACKLOG,
+            "drain_rate": round(self.drain_rate, 2),
+            "shedding": bool(settings.ADMISSION_MAX_BACKLOG) and self.backlog >= settings.ADMISSION_MAX_BACKLOG,
+            "tenants": [
+                {"tenant_id": tenant_id, "backlog": count, "max_backlog": self._tenant_limit(tenant_id)}
+                for tenant_id, count in busiest
+            ]
+        }
+
+# Global admission controller instance
+admission = AdmissionController()
@@ -0,0 +1,98 @@
+"""
+Size-or-deadline batching shared by the ingest writer, the ingest log and
+batched delivery
+Concurrent callers queue an item and wait; one task hands the items to a
+flush function in batches
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+Batch = List[Tuple[Any, asyncio.Future]]
+
+class BatchQueue:
+    """
+    Collects (item, future) pairs into batches for a flush function
+
+    The first queued item opens a window of max_wait seconds; the batch is
+    flushed as soon as it holds max_size items (None = no limit) or the
+    window closes. flush resolves each caller's future. Batches are flushed
+    one at a time, in order.
+    """
+    def __init__(
+        self,
+        flush: Callable[[Batch], Awaitable[None]],
+        max_size: Optional[int],
+        max_wait: float
+    ):
+        self.flush = flush
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the batching task on the running loop (no-op if running)"""
+        if not self.running:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item for the next batch and wait for flush to resolve it"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self) -> Tuple[Batch, bool]:
+        """
+        Wait for one item, then gather more until the batch is full or the window closes
+
+        Returns:
+            (batch, stop_requested)
+        """
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while self.max_size is None or len(batch) < self.max_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, stop_requested = await self._collect()
+            if batch:
+                await self.flush(batch)
+            if stop_requested:
+                return
+
+    async def stop(self):
+        """Stop after flushing everything already queued"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            # None is the stop sentinel; it is queued behind pending items
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
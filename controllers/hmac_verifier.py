@@ -1,6 +1,23 @@
 import hmac
 import hashlib
-from typing import Optional
+from functools import lru_cache
+from typing import AsyncIterator, Optional, Sequence
+from config import settings
+
+@lru_cache(maxsize=settings.HMAC_KEY_CACHE_SIZE)
+def _keyed_hmac(secret: str):
+    """HMAC object with the key schedule for secret already computed"""
+    return hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+
+def new_hmac(secret: str):
+    """Fresh HMAC for secret, copied from the cached pre-keyed object"""
+    return _keyed_hmac(secret).copy()
+
+def sign_body(secret: str, body: bytes) -> str:
+    """Signature header value for body, in the same sha256=<hex> format we verify"""
+    mac = new_hmac(secret)
+    mac.update(body)
+    return "sha256=" + mac.hexdigest()
 
 def verify_hmac_signature(
     body: bytes,
@@ -26,12 +43,89 @@ def verify_hmac_signature(
         signature = signature[7:]
     
     # Calculate expected signature
-    expected_signature = hmac.new(
-        secret.encode('utf-8'),
-        body,
-        hashlib.sha256
-    ).hexdigest()
+    mac = new_hmac(secret)
+    mac.update(body)
+    expected_signature = mac.hexdigest()
     
     # Constant-time comparison to prevent timing attacks
     return hmac.compare_digest(expected_signature, signature)
 
+
+class SignatureError(Exception):
+    """Body does not match the signature"""
+
+class BodyTooLargeError(Exception):
+    """Body exceeds the allowed size"""
+
+def parse_signature(signature: Optional[str]) -> Optional[str]:
+    """
+    Validate the format of a signature header
+    
+    Args:
+        signature: Signature from header (format: sha256=<64 hex chars>)
+        
+    Returns:
+        Lowercase hex digest, or None if missing or malformed
+    """
+    if not signature:
+        return None
+    
+    if signature.startswith('sha256='):
+        signature = signature[7:]
+    
+    if len(signature) != hashlib.sha256().digest_size * 2:
+        return None
+    try:
+        bytes.fromhex(signature)
+    except ValueError:
+        return None
+    return signature.lower()
+
+async def read_verified_body(
+    chunks: AsyncIterator[bytes],
+    expected_digest: str,
+    secrets: Sequence[str],
+    max_bytes: int
+) -> bytes:
+    """
+    Read a streamed body while computing its HMAC incrementally
+    
+    Reading stops as soon as the body grows past max_bytes, and the
+    buffered chunks are only joined and returned if the signature matches
+    one of the secrets (several are active while a secret is rotated).
+    
+    Args:
+        chunks: Async iterator of body chunks (e.g. request.stream())
+        expected_digest: Hex digest from parse_signature()
+        secrets: Active secrets for the tenant
+        max_bytes: Maximum accepted body size
+        
+    Returns:
+        The verified body
+        
+    Raises:
+        BodyTooLargeError: Body is larger than max_bytes
+        SignatureError: Signature does not match
+    """
+    macs = [new_hmac(secret) for secret in secrets]
+    buffer = []
+    size = 0
+    
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyTooLargeError(f"Body exceeds {max_bytes} bytes")
+        for mac in macs:
+            mac.update(chunk)
+        buffer.append(chunk)
+    
+    # Check every secret so timing doesn't reveal which one matched
+    matched = False
+    for mac in macs:
+        matched |= hmac.compare_digest(mac.hexdigest(), expected_digest)
+    if not matched:
+        raise SignatureError("Invalid signature")
+    
+    return b"".join(buffer)
@@ -0,0 +1,77 @@
+"""
+Duplicate-delivery suppression
+Derives an idempotency key per webhook and remembers recently seen keys
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+from config import settings
+
+# Cached in place of an event id while an accepted delivery sits in the
+# ingest log and hasn't been assigned a row yet (event ids start at 1)
+EVENT_ID_PENDING = 0
+
+def idempotency_key(tenant_id: str, headers: Mapping[str, str], body: bytes) -> Optional[str]:
+    """
+    Key identifying a delivery within a tenant
+    
+    Uses the first provider event id header present (IDEMPOTENCY_HEADERS),
+    otherwise a hash of the raw body if IDEMPOTENCY_HASH_BODY is enabled.
+    
+    Returns:
+        64-char hex key, or None if the event can't be identified
+    """
+    if not settings.IDEMPOTENCY_ENABLED:
+        return None
+    
+    digest = hashlib.sha256(tenant_id.encode('utf-8') + b"\0")
+    for name in settings.IDEMPOTENCY_HEADERS:
+        value = headers.get(name)
+        if value:
+            digest.update(b"header\0" + value.encode('utf-8'))
+            return digest.hexdigest()
+    
+    if settings.IDEMPOTENCY_HASH_BODY:
+        digest.update(b"body\0" + body)
+        return digest.hexdigest()
+    return None
+
+class IdempotencyCache:
+    """
+    Bounded in-memory map of recently seen keys with a TTL
+    
+    Entries are kept in insertion order, so the oldest are evicted first
+    when the cache is full. Values are event ids, or a future while the
+    first delivery of a key is still being written (EVENT_ID_PENDING once
+    it is in the ingest log but not yet loaded).
+    """
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[int] = None):
+        self.max_size = max_size or settings.IDEMPOTENCY_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else settings.IDEMPOTENCY_TTL_SECONDS
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+    
+    def put(self, key: str, value: Any):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def discard(self, key: str):
+        self._entries.pop(key, None)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Global cache shared by the webhook route and the ingest log loader
+idempotency_cache = IdempotencyCache()
@@ -0,0 +1,91 @@
+"""
+Pluggable JSON codec used for ingest parsing, forwarding, the database JSON
+column and admin responses
+
+Backends: orjson or msgspec when installed, stdlib json otherwise. Select one
+with the JSON_CODEC setting ("auto", "orjson", "msgspec" or "stdlib").
+"""
+import json
+import sys
+from typing import Any, Union
+from fastapi.responses import JSONResponse
+from config import settings
+
+class JSONDecodeError(ValueError):
+    """Raised by loads() for malformed input, whatever the backend"""
+
+def _stdlib_codec():
+    decode_error = json.JSONDecodeError
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        # Same compact form Starlette's JSONResponse produces
+        return json.dumps(
+            obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    return loads, dumps, decode_error
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    return orjson.loads, dumps, orjson.JSONDecodeError
+
+def _msgspec_codec():
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+    return decoder.decode, encoder.encode, msgspec.DecodeError
+
+_BACKENDS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "stdlib": _stdlib_codec,
+}
+
+def _select_backend(name: str):
+    """Return (name, loads, dumps, decode_error) for the requested backend"""
+    name = (name or "auto").lower()
+    candidates = list(_BACKENDS) if name == "auto" else [name]
+    for candidate in candidates:
+        factory = _BACKENDS.get(candidate)
+        if factory is None:
+            print(f"Warning: unknown JSON_CODEC '{candidate}'; using stdlib json.", file=sys.stderr)
+            break
+        try:
+            return (candidate, *factory())
+        except ImportError:
+            if name != "auto":
+                print(
+                    f"Warning: JSON_CODEC '{candidate}' is not installed; using stdlib json.",
+                    file=sys.stderr,
+                )
+    return ("stdlib", *_stdlib_codec())
+
+backend, _loads, _dumps, _decode_error = _select_backend(settings.JSON_CODEC)
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode JSON from bytes or str"""
+    try:
+        return _loads(data)
+    except (_decode_error, UnicodeDecodeError) as e:
+        raise JSONDecodeError(str(e)) from e
+
+def dumps(obj: Any) -> bytes:
+    """Encode obj as compact UTF-8 JSON bytes"""
+    return _dumps(obj)
+
+def dumps_str(obj: Any) -> str:
+    """Encode obj as a JSON str (for SQLAlchemy's json_serializer)"""
+    return _dumps(obj).decode("utf-8")
+
+class CodecJSONResponse(JSONResponse):
+    """JSONResponse rendered with the configured codec backend"""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,70 +1,252 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
 import time
-from collections import defaultdict
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
 from config import settings
 
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int  # requests still allowed right now
+    reset_after: float  # seconds until the tenant's full burst is available again
+    retry_after: float  # seconds until the next request is allowed (0 if allowed)
+
+def gcra(tat: float, now: float, emission_interval: float, tolerance: float) -> Tuple[bool, float]:
+    """
+    One step of the generic cell rate algorithm
+    
+    Args:
+        tat: Stored theoretical arrival time (0 for an unseen tenant)
+        now: Current time
+        emission_interval: Seconds per request at the sustained rate
+        tolerance: How far ahead of now the TAT may run (burst allowance)
+        
+    Returns:
+        (allowed, tat) - the TAT to store if allowed, else the unchanged TAT
+    """
+    tat = max(tat, now)
+    if tat - now > tolerance:
+        return False, tat
+    return True, tat + emission_interval
+
+class MemoryBucketStore:
+    """
+    Per-process bucket state; limits apply to each worker process separately
+    
+    Tenants are kept in least-recently-checked order. Whenever a new tenant
+    is added, a few of the oldest tenants whose bucket has fully refilled
+    are evicted (forgetting them is lossless), so expiry work is spread over
+    the requests that grow the table instead of a periodic full sweep. Past
+    max_tenants the oldest tenant is dropped even if it is still limited,
+    which resets that tenant to a full burst.
+    """
+    blocking = False
+    
+    def __init__(self, max_tenants: Optional[int] = None, evictions_per_check: Optional[int] = None):
+        self.max_tenants = max_tenants or settings.RATE_LIMIT_MAX_TENANTS
+        if evictions_per_check is None:
+            evictions_per_check = settings.RATE_LIMIT_EVICTIONS_PER_CHECK
+        self.evictions_per_check = evictions_per_check
+        # Format: {tenant_id: theoretical_arrival_time}, oldest check first
+        self.tat: "OrderedDict[str, float]" = OrderedDict()
+    
+    def acquire(self, tenant_id: str, now: float, emission_interval: float, tolerance: float) -> Tuple[bool, float]:
+        tat_by_tenant = self.tat
+        previous = tat_by_tenant.get(tenant_id)
+        allowed, tat = gcra(previous or 0.0, now, emission_interval, tolerance)
+        if allowed:
+            tat_by_tenant[tenant_id] = tat
+        if previous is not None:
+            tat_by_tenant.move_to_end(tenant_id)
+        elif allowed:
+            self._evict(now)
+        return allowed, tat
+    
+    def _evict(self, now: float):
+        """Drop a bounded number of expired tenants from the old end"""
+        tat_by_tenant = self.tat
+        for _ in range(self.evictions_per_check):
+            oldest_tenant = next(iter(tat_by_tenant), None)
+            if oldest_tenant is None or tat_by_tenant[oldest_tenant] > now:
+                break
+            del tat_by_tenant[oldest_tenant]
+        
+        while len(tat_by_tenant) > self.max_tenants:
+            tat_by_tenant.popitem(last=False)
+
+class SQLiteBucketStore:
+    """
+    Bucket state shared by every process on the host through a local SQLite file
+    
+    Each check is a short BEGIN IMMEDIATE transaction, so concurrent workers
+    serialize on the file lock and limits are exact across processes. The
+    state is disposable, so the file runs in WAL mode without fsync. Each
+    check also deletes a few fully refilled tenants through the tat index,
+    keeping the table small without a periodic sweep.
+    
+    Waiting for the file lock blocks, so async callers run checks on a
+    thread; the process shares one connection, used by one check at a time.
+    """
+    blocking = True
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.RATE_LIMIT_SQLITE_PATH
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+    
+    def _connection(self) -> sqlite3.Connection:
+        # Connect lazily and per process: uvicorn may fork after import
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                "(tenant_id TEXT PRIMARY KEY, tat REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_rate_limit_buckets_tat ON rate_limit_buckets (tat)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+    
+    def acquire(self, tenant_id: str, now: float, emission_interval: float, tolerance: float) -> Tuple[bool, float]:
+        with self._lock:
+            return self._acquire(tenant_id, now, emission_interval, tolerance)
+    
+    def _acquire(self, tenant_id: str, now: float, emission_interval: float, tolerance: float) -> Tuple[bool, float]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tat FROM rate_limit_buckets WHERE tenant_id = ?", (tenant_id,)
+            ).fetchone()
+            allowed, tat = gcra(row[0] if row else 0.0, now, emission_interval, tolerance)
+            if allowed:
+                conn.execute(
+                    "INSERT INTO rate_limit_buckets (tenant_id, tat) VALUES (?, ?) "
+                    "ON CONFLICT(tenant_id) DO UPDATE SET tat = excluded.tat",
+                    (tenant_id, tat)
+                )
+            conn.execute(
+                "DELETE FROM rate_limit_buckets WHERE rowid IN "
+                "(SELECT rowid FROM rate_limit_buckets WHERE tat <= ? LIMIT ?)",
+                (now, settings.RATE_LIMIT_EVICTIONS_PER_CHECK)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, tat
+
+def create_bucket_store():
+    """Bucket store selected by RATE_LIMIT_BACKEND"""
+    backend = settings.RATE_LIMIT_BACKEND.lower()
+    if backend == "sqlite":
+        return SQLiteBucketStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+    return MemoryBucketStore()
+
 class RateLimiter:
     """
-    Simple in-memory rate limiter using sliding window
+    GCRA rate limiter
+    
+    Equivalent to a token bucket refilled at `limit` per window holding up to
+    `burst` tokens, but each tenant costs a single float (its theoretical
+    arrival time), so checks are O(1) regardless of the configured limit.
+    State lives in a bucket store: per process in memory, or shared by all
+    worker processes on the host (RATE_LIMIT_BACKEND=sqlite).
     """
-    def __init__(self):
-        # Store request timestamps per tenant
-        # Format: {tenant_id: [timestamp1, timestamp2, ...]}
-        self.requests = defaultdict(list)
-        self.last_cleanup = time.time()
-        self.cleanup_interval = 60  # Clean up old entries every 60 seconds
-    
-    def _cleanup_old_entries(self, now: float, window: int = 1):
-        """Remove entries older than the window"""
-        cutoff = now - window
-        for tenant_id in list(self.requests.keys()):
-            self.requests[tenant_id] = [
-                ts for ts in self.requests[tenant_id] if ts > cutoff
-            ]
-            # Remove empty entries
-            if not self.requests[tenant_id]:
-                del self.requests[tenant_id]
+    def __init__(self, store=None):
+        self.store = store or create_bucket_store()
+        self._limit_overrides = settings.TENANT_RATE_LIMITS
+        self._burst_overrides = settings.TENANT_RATE_BURSTS
+        # Format: {(limit, window, tenant_override_key): (limit, emission_interval, tolerance)}
+        self._params: Dict[tuple, Tuple[int, float, float]] = {}
+    
+    def limits_for(self, tenant_id: str, limit: Optional[int] = None) -> Tuple[int, int]:
+        """(limit, burst) for a tenant, clamped to MAX_RATE_LIMIT"""
+        if limit is None:
+            limit = settings.TENANT_RATE_LIMITS.get(tenant_id, settings.DEFAULT_RATE_LIMIT)
+        limit = max(1, min(limit, settings.MAX_RATE_LIMIT))
+        
+        burst = settings.TENANT_RATE_BURSTS.get(tenant_id, settings.DEFAULT_RATE_BURST)
+        burst = max(1, min(burst or limit, settings.MAX_RATE_LIMIT))
+        return limit, burst
+    
+    def _gcra_params(self, tenant_id: str, limit: Optional[int], window: int) -> Tuple[int, float, float]:
+        """(limit, emission_interval, tolerance), computed once per distinct configuration"""
+        overridden = tenant_id in self._limit_overrides or tenant_id in self._burst_overrides
+        key = (limit, window, tenant_id if overridden else None)
+        params = self._params.get(key)
+        if params is None:
+            limit, burst = self.limits_for(tenant_id, limit)
+            emission_interval = window / limit
+            params = (limit, emission_interval, emission_interval * (burst - 1))
+            self._params[key] = params
+        return params
     
     def check_rate_limit(
         self,
         tenant_id: str,
         limit: int = None,
         window: int = 1
-    ) -> tuple:
+    ) -> RateLimitResult:
         """
-        Simple sliding window rate limiting
+        Check and consume one request for a tenant
         
         Args:
             tenant_id: Tenant identifier
-            limit: Events per window (default from settings)
+            limit: Events per window (default: TENANT_RATE_LIMITS / DEFAULT_RATE_LIMIT)
             window: Time window in seconds (default 1)
             
         Returns:
-            (is_allowed, remaining_tokens)
+            RateLimitResult
         """
-        if limit is None:
-            limit = settings.DEFAULT_RATE_LIMIT
-        
+        limit, emission_interval, tolerance = self._gcra_params(tenant_id, limit, window)
         now = time.time()
+        allowed, tat = self.store.acquire(tenant_id, now, emission_interval, tolerance)
+        return self._result(limit, emission_interval, tolerance, now, allowed, tat)
+    
+    async def check_rate_limit_async(
+        self,
+        tenant_id: str,
+        limit: int = None,
+        window: int = 1
+    ) -> RateLimitResult:
+        """
+        check_rate_limit for request handlers
         
-        # Periodic cleanup
-        if now - self.last_cleanup > self.cleanup_interval:
-            self._cleanup_old_entries(now, window)
-            self.last_cleanup = now
-        
-        # Get requests in current window
-        cutoff = now - window
-        tenant_requests = [
-            ts for ts in self.requests[tenant_id] if ts > cutoff
-        ]
-        
-        # Check if limit exceeded
-        if len(tenant_requests) >= limit:
-            return False, 0
-        
-        # Add current request
-        tenant_requests.append(now)
-        self.requests[tenant_id] = tenant_requests
+        A store that blocks (the shared SQLite file) is checked on a thread,
+        so contention between processes never stalls the event loop.
+        """
+        if not self.store.blocking:
+            return self.check_rate_limit(tenant_id, limit, window)
+        limit, emission_interval, tolerance = self._gcra_params(tenant_id, limit, window)
+        now = time.time()
+        allowed, tat = await asyncio.get_running_loop().run_in_executor(
+            None, self.store.acquire, tenant_id, now, emission_interval, tolerance
+        )
+        return self._result(limit, emission_interval, tolerance, now, allowed, tat)
+    
+    @staticmethod
+    def _result(
+        limit: int,
+        emission_interval: float,
+        tolerance: float,
+        now: float,
+        allowed: bool,
+        tat: float
+    ) -> RateLimitResult:
+        if not allowed:
+            return RateLimitResult(False, limit, 0, tat - now, tat - now - tolerance)
         
-        remaining = limit - len(tenant_requests)
-        return True, remaining
+        remaining = int(math.floor((tolerance - (tat - now)) / emission_interval + 1e-9)) + 1
+        return RateLimitResult(True, limit, max(0, remaining), tat - now, 0.0)
@@ -0,0 +1,97 @@
+"""
+Per-tenant signing secret registry
+Maps X-Tenant-ID to its active secrets, loaded from a file or the database
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+import yaml
+from sqlalchemy.orm import Session
+from db.database import run_in_session
+from models.webhook_models import TenantSecret
+from config import settings
+
+def _normalize(mapping: dict) -> Dict[str, Tuple[str, ...]]:
+    """Turn {tenant: secret | [secrets]} into {tenant: (secrets, ...)}"""
+    secrets = {}
+    for tenant_id, value in (mapping or {}).items():
+        values = [value] if isinstance(value, str) else list(value or [])
+        values = tuple(str(v) for v in values if v)
+        if values:
+            secrets[str(tenant_id)] = values
+    return secrets
+
+def load_secrets_file(path: str) -> Dict[str, Tuple[str, ...]]:
+    """Load a JSON or YAML mapping of tenant -> secret or list of secrets"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return _normalize(json.load(f))
+        return _normalize(yaml.safe_load(f))
+
+def load_secrets_db(db: Session) -> Dict[str, Tuple[str, ...]]:
+    """Load active secrets from the tenant_secrets table, newest first"""
+    rows = db.query(TenantSecret.tenant_id, TenantSecret.secret).filter(
+        TenantSecret.active == True  # noqa: E712
+    ).order_by(TenantSecret.tenant_id, TenantSecret.created_at.desc()).all()
+    
+    grouped: Dict[str, list] = {}
+    for row in rows:
+        grouped.setdefault(row.tenant_id, []).append(row.secret)
+    return _normalize(grouped)
+
+class TenantSecretRegistry:
+    """
+    Active signing secrets per tenant
+
+    Lookups are plain dict reads; reload() swaps in a complete new mapping so
+    requests never see a half-loaded registry. Tenants without an entry use
+    WEBHOOK_SECRET.
+    """
+    def __init__(self, source: Optional[str] = None):
+        self.source = (source or settings.TENANT_SECRETS_SOURCE).lower()
+        self._secrets: Dict[str, Tuple[str, ...]] = {}
+        self._file_mtime: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+    
+    def secrets_for(self, tenant_id: str) -> Tuple[str, ...]:
+        """Active secrets for a tenant, newest first"""
+        return self._secrets.get(tenant_id) or (settings.WEBHOOK_SECRET,)
+    
+    def _load(self, db: Session) -> Optional[Dict[str, Tuple[str, ...]]]:
+        """Read the configured source; None means nothing changed"""
+        if self.source == "db":
+            return load_secrets_db(db)
+        if self.source == "file":
+            path = settings.TENANT_SECRETS_FILE
+            if not os.path.exists(path):
+                return {}
+            mtime = os.path.getmtime(path)
+            if mtime == self._file_mtime:
+                return None
+            secrets = load_secrets_file(path)
+            self._file_mtime = mtime
+            return secrets
+        return {}
+    
+    async def reload(self):
+        """Reload secrets from the configured source"""
+        if self.source == "none":
+            return
+        secrets = await run_in_session(self._load)
+        if secrets is not None:
+            self._secrets = secrets
+        self.loaded_at = time.time()
+    
+    async def refresh_loop(self):
+        """Periodically reload so rotated secrets take effect without a restart"""
+        while True:
+            await asyncio.sleep(settings.TENANT_SECRETS_REFRESH_SECONDS)
+            try:
+                await self.reload()
+            except Exception as e:
+                print(f"Tenant secret reload error: {e}")
+
+# Global registry instance
+tenant_secrets = TenantSecretRegistry()
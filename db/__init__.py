@@ -1,4 +1,4 @@
-from .database import engine, SessionLocal, init_db
+from .database import engine, SessionLocal, init_db, run_in_session
 
-__all__ = ["engine", "SessionLocal", "init_db"]
+__all__ = ["engine", "SessionLocal", "init_db", "run_in_session"]
 
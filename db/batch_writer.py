@@ -0,0 +1,108 @@
+"""
+Group-commit writer for accepted webhooks
+Collects events from concurrent requests and inserts them in one transaction
+"""
+import asyncio
+from typing import List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from db.database import run_in_session
+from controllers.batch_queue import BatchQueue
+from models.webhook_models import WebhookEvent
+from config import settings
+
+def _insert_one_or_existing(db: Session, event: WebhookEvent) -> Tuple[int, bool]:
+    """Insert an event inside a savepoint, or find the row already holding its idempotency key"""
+    try:
+        with db.begin_nested():
+            db.add(event)
+            db.flush()
+        return event.id, True
+    except IntegrityError:
+        if event.idempotency_key is None:
+            raise
+        existing = db.query(WebhookEvent.id).filter(
+            WebhookEvent.idempotency_key == event.idempotency_key
+        ).first()
+        if existing is None:
+            raise
+        return existing.id, False
+
+def _insert_batch(db: Session, events: List[WebhookEvent]) -> List[Tuple[int, bool]]:
+    """
+    Insert events in a single transaction
+
+    Returns:
+        (event_id, created) per event, in order. created is False when the
+        event's idempotency key already existed and the original id is returned.
+    """
+    try:
+        db.add_all(events)
+        # Flush assigns primary keys; SQLAlchemy emits one multi-row INSERT ...
+        # RETURNING where the dialect supports it (SQLite, MariaDB)
+        db.flush()
+        results = [(event.id, True) for event in events]
+        db.commit()
+        return results
+    except IntegrityError:
+        # A duplicate from another process (or within this batch) hit the
+        # unique index; fall back to row-by-row inserts to resolve it
+        db.rollback()
+    
+    results = [_insert_one_or_existing(db, event) for event in events]
+    db.commit()
+    return results
+
+class IngestBatchWriter:
+    """
+    Amortizes commits across concurrent ingest requests
+
+    The first queued event opens a batch window of max_wait_ms; the batch is
+    written as soon as it reaches max_batch_size or the window closes. Each
+    caller's submit() resolves with its event id only after the commit, so an
+    acknowledged webhook is always durable.
+    """
+    def __init__(
+        self,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[int] = None
+    ):
+        self.max_batch_size = max(1, max_batch_size or settings.INGEST_BATCH_MAX_SIZE)
+        if max_wait_ms is None:
+            max_wait_ms = settings.INGEST_BATCH_MAX_WAIT_MS
+        self.max_wait = max_wait_ms / 1000
+        self._batches = BatchQueue(self._flush, self.max_batch_size, self.max_wait)
+    
+    def start(self):
+        """Start the writer task on the running loop (no-op if running)"""
+        self._batches.start()
+    
+    async def submit(self, event: WebhookEvent) -> Tuple[int, bool]:
+        """
+        Queue an event for the next batch and wait for it to be committed
+
+        Returns:
+            (event_id, created); created is False for a duplicate idempotency key
+        """
+        return await self._batches.submit(event)
+    
+    async def _flush(self, batch: List[Tuple[WebhookEvent, asyncio.Future]]):
+        """Write one batch and resolve its callers"""
+        try:
+            results = await run_in_session(_insert_batch, [event for event, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def stop(self):
+        """Stop the writer after committing everything already queued"""
+        await self._batches.stop()
+
+# Global writer instance
+ingest_writer = IngestBatchWriter()
@@ -1,14 +1,58 @@
-from sqlalchemy import create_engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from config import settings
+from controllers import json_codec
 from models.webhook_models import Base
 
-engine = create_engine(settings.DATABASE_URL, echo=False)
+engine = create_engine(
+    settings.DATABASE_URL,
+    echo=False,
+    json_serializer=json_codec.dumps_str,
+    json_deserializer=json_codec.loads
+)
 SessionLocal = sessionmaker(autoflush=False, bind=engine)
 
+# Dedicated thread pool for blocking database work, so async handlers and the
+# worker never run SQLAlchemy I/O on the event loop thread
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_EXECUTOR_WORKERS,
+    thread_name_prefix="db"
+)
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    _upgrade_schema()
+
+def _upgrade_schema():
+    """
+    Add columns and indexes introduced after a table was first created
+
+    create_all() only creates missing tables, so databases created by an
+    earlier version are brought up to date here. New columns must be
+    nullable or have no server-side requirements.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                ))
+            
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
 
 def get_db():
     """Dependency for getting database session"""
@@ -18,3 +62,21 @@ def get_db():
     finally:
         db.close()
 
+def _call_with_session(fn, *args):
+    """Run fn(db, *args) with a fresh session, closing it afterwards"""
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def run_in_session(fn, *args):
+    """
+    Run fn(db, *args) on the DB executor without blocking the event loop
+
+    The session is created, used and closed entirely inside the executor
+    thread, so fn must do all of its ORM work (including commits and reading
+    any attributes it returns) before returning.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, _call_with_session, fn, *args)
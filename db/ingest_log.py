@@ -0,0 +1,316 @@
+"""
+Append-only write-ahead log for fast webhook acknowledgement
+Verified webhooks are appended to local segment files and acknowledged once
+fsynced; a background loader drains the segments into webhook_events in bulk
+"""
+import asyncio
+import fcntl
+import os
+import struct
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from db.database import run_in_session
+from db.batch_writer import _insert_batch
+from controllers.batch_queue import BatchQueue
+from controllers import json_codec
+from controllers.idempotency import idempotency_cache, EVENT_ID_PENDING
+from models.webhook_models import WebhookEvent
+from config import settings
+
+# Record framing: payload length and CRC32, then the JSON-encoded fields
+_HEADER = struct.Struct(">II")
+_WRITER_PREFIX = "writer-"
+_STAGING_PREFIX = ".staging-"
+_SEGMENT_SUFFIX = ".log"
+
+def _encode_record(fields: dict) -> bytes:
+    payload = json_codec.dumps(fields)
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def _read_records(path: str, offset: int, end: Optional[int], limit: int) -> Tuple[List[dict], int]:
+    """
+    Read up to `limit` complete records starting at `offset`
+
+    Stops early at `end` (bytes known to be durable), a torn write or a
+    corrupt record, so a crash mid-append only loses unacknowledged data.
+
+    Returns:
+        (records, offset just past the last record read)
+    """
+    records = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while len(records) < limit and (end is None or offset < end):
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            length, crc = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(json_codec.loads(payload))
+            offset += _HEADER.size + length
+    return records, offset
+
+def _segment_paths(directory: str) -> List[str]:
+    names = sorted(n for n in os.listdir(directory) if n.endswith(_SEGMENT_SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+def _fsync_dir(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _record_to_event(record: dict) -> WebhookEvent:
+    fields = dict(record)
+    fields["created_at"] = datetime.utcfromtimestamp(fields.pop("received_at"))
+    return WebhookEvent(status="pending", **fields)
+
+async def _load_records(records: List[dict]):
+    """Insert logged records; keys already present (earlier partial load) are skipped"""
+    events = [_record_to_event(record) for record in records]
+    results = await run_in_session(_insert_batch, events)
+    for record, (event_id, _) in zip(records, results):
+        key = record["idempotency_key"]
+        if idempotency_cache.get(key) == EVENT_ID_PENDING:
+            idempotency_cache.put(key, event_id)
+
+class _Segment:
+    def __init__(self, path: str, durable: int = 0, sealed: bool = False):
+        self.path = path
+        self.durable = durable  # bytes written and fsynced
+        self.sealed = sealed
+
+class IngestLog:
+    """
+    Segmented write-ahead ingest log owned by one process
+
+    Each process appends to its own directory under INGEST_LOG_DIR, held with
+    an exclusive flock for its lifetime. Appends from concurrent requests are
+    written and fsynced together (group commit, INGEST_LOG_FSYNC_MS window);
+    segments roll over at INGEST_LOG_SEGMENT_BYTES. The loader reads only
+    fsynced bytes and deletes a segment once it is sealed and fully loaded.
+
+    Every record carries an idempotency key (a random one if the webhook had
+    none), so re-loading a partially loaded segment after a crash is safe:
+    the unique index turns repeats into no-ops. At startup, directories
+    whose lock is free belong to dead processes and are replayed.
+    """
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.INGEST_LOG_DIR
+        # Called with each tenant that had records inserted (the worker's wakeup)
+        self.on_loaded: Optional[Callable[[str], None]] = None
+        self.directory: Optional[str] = None
+        self._lock_fd: Optional[int] = None
+        # One thread keeps file writes ordered and off the event loop
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-log")
+        self._segments: "deque[_Segment]" = deque()
+        self._file = None
+        self._next_segment = 0
+        # Records fsynced together: whatever arrives within INGEST_LOG_FSYNC_MS
+        self._appends = BatchQueue(self._flush, None, settings.INGEST_LOG_FSYNC_MS / 1000)
+        self._load_task: Optional[asyncio.Task] = None
+        self._data_ready: Optional[asyncio.Event] = None
+        self._load_offset = 0  # position of the loader in the oldest segment
+
+    async def _run_io(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    # Startup / shutdown
+
+    async def open(self):
+        """Replay logs left by dead processes, then start appending and loading"""
+        os.makedirs(self.root, exist_ok=True)
+        await self.recover()
+
+        # Lock the directory before it gets a writer- name, so recover() in
+        # another process never sees it unlocked
+        name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        staging = os.path.join(self.root, f"{_STAGING_PREFIX}{name}")
+        os.makedirs(staging)
+        self._lock_fd = os.open(os.path.join(staging, "lock"), os.O_CREAT | os.O_RDWR)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.directory = os.path.join(self.root, f"{_WRITER_PREFIX}{name}")
+        os.rename(staging, self.directory)
+        _fsync_dir(self.root)
+        await self._run_io(self._open_segment)
+
+        self._data_ready = asyncio.Event()
+        self._appends.start()
+        self._load_task = asyncio.create_task(self._load_loop())
+
+    async def recover(self):
+        """Load every segment of log directories not locked by a live process"""
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if not name.startswith(_WRITER_PREFIX) or directory == self.directory:
+                continue
+            try:
+                lock_fd = os.open(os.path.join(directory, "lock"), os.O_RDWR)
+            except FileNotFoundError:
+                continue  # Already recovered by another process
+            try:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Owned by a running process
+                if os.fstat(lock_fd).st_nlink == 0:
+                    continue  # Recovered and removed by another process before we locked it
+
+                for path in _segment_paths(directory):
+                    offset = 0
+                    while True:
+                        records, offset = await self._run_io(
+                            _read_records, path, offset, None, settings.INGEST_LOG_LOAD_BATCH
+                        )
+                        if not records:
+                            break
+                        await _load_records(records)
+                    os.remove(path)
+                    print(f"Recovered ingest log segment {path}")
+                os.remove(os.path.join(directory, "lock"))
+                os.rmdir(directory)
+            finally:
+                os.close(lock_fd)
+
+    async def close(self):
+        """Flush pending appends, load everything logged, and remove this process's log"""
+        if not self._appends.running:
+            return
+        await self._appends.stop()
+
+        self._load_task.cancel()
+        try:
+            await self._load_task
+        except asyncio.CancelledError:
+            pass
+        self._load_task = None
+
+        try:
+            while await self._load_available():
+                pass
+        except Exception as e:
+            # Segments stay on disk and are replayed by the next process
+            print(f"Ingest log not fully loaded at shutdown: {e}")
+        else:
+            await self._run_io(self._file.close)
+            for segment in self._segments:
+                os.remove(segment.path)
+            self._segments.clear()
+            os.remove(os.path.join(self.directory, "lock"))
+            os.rmdir(self.directory)
+        finally:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # Appending
+
+    def _open_segment(self):
+        """Start a new active segment (runs on the log thread)"""
+        path = os.path.join(self.directory, f"{self._next_segment:012d}{_SEGMENT_SUFFIX}")
+        self._next_segment += 1
+        self._file = open(path, "ab")
+        _fsync_dir(self.directory)
+        self._segments.append(_Segment(path))
+
+    def _write(self, data: bytes) -> int:
+        """Append and fsync (runs on the log thread); returns the new segment size"""
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def _rotate(self):
+        """Seal the active segment once its successor exists (runs on the log thread)"""
+        previous_file, previous = self._file, self._segments[-1]
+        self._open_segment()
+        previous.sealed = True
+        previous_file.close()
+
+    async def append(self, fields: dict):
+        """
+        Durably log one webhook; returns once it is fsynced
+
+        fields are WebhookEvent column values. An idempotency key is
+        assigned if missing so replays after a crash can't duplicate it.
+        """
+        if not fields.get("idempotency_key"):
+            fields["idempotency_key"] = uuid.uuid4().hex
+        fields["received_at"] = time.time()
+        await self._appends.submit(_encode_record(fields))
+
+    async def _flush(self, batch: List[Tuple[bytes, asyncio.Future]]):
+        """Write and fsync one batch, then acknowledge its callers"""
+        try:
+            size = await self._run_io(self._write, b"".join(data for data, _ in batch))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._segments[-1].durable = size
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        self._data_ready.set()
+
+        if size >= settings.INGEST_LOG_SEGMENT_BYTES:
+            try:
+                await self._run_io(self._rotate)
+            except Exception as e:
+                # Keep appending to the current segment and try again next flush
+                print(f"Ingest log rotation failed: {e}")
+
+    # Loading
+
+    async def _load_available(self) -> bool:
+        """Load one batch of durable records; returns False when caught up"""
+        while self._segments:
+            segment = self._segments[0]
+            records, offset = await self._run_io(
+                _read_records, segment.path, self._load_offset, segment.durable,
+                settings.INGEST_LOG_LOAD_BATCH
+            )
+            if records:
+                await _load_records(records)
+                self._load_offset = offset
+                if self.on_loaded is not None:
+                    for tenant_id in {record["tenant_id"] for record in records}:
+                        self.on_loaded(tenant_id)
+                return True
+            if segment.sealed and self._load_offset >= segment.durable:
+                os.remove(segment.path)
+                self._segments.popleft()
+                self._load_offset = 0
+                continue
+            return False
+        return False
+
+    async def _load_loop(self):
+        while True:
+            # Cleared before reading, so a flush that lands while the read is
+            # queued behind it on the I/O thread wakes the next pass
+            self._data_ready.clear()
+            try:
+                if await self._load_available():
+                    continue
+            except Exception as e:
+                # Database unavailable; records stay in the log until it recovers
+                print(f"Ingest log load error: {e}")
+                await asyncio.sleep(settings.INGEST_LOG_LOAD_RETRY_SECONDS)
+                continue
+            await self._data_ready.wait()
+
+    def unloaded_segments(self) -> int:
+        return len(self._segments)
+
+# Global ingest log instance (only opened when INGEST_MODE is "log")
+ingest_log = IngestLog()
@@ -15,6 +15,15 @@ async def receive_internal_webhook(request: Request):
     """Receive forwarded webhook from gateway"""
     payload = await request.json()
     
+    # Batched delivery (BATCH_DELIVERY_URLS): an array of payloads, answered
+    # with one result per event in the same order
+    if isinstance(payload, list):
+        print(f"✅ Received batch of {len(payload)} webhooks")
+        return {
+            "status": "success",
+            "results": [{"status": 200} for _ in payload]
+        }
+    
     # Simulate processing
     print(f"✅ Received webhook: {payload.get('type', 'unknown')}")
     print(f"   Payload: {payload}")
@@ -4,16 +4,39 @@ import asyncio
 from contextlib import asynccontextmanager
 from routes import webhook_routes, admin_routes
 from db.database import init_db
+from db.batch_writer import ingest_writer
+from db.ingest_log import ingest_log
+from config import settings
+from controllers.tenant_secrets import tenant_secrets
+from controllers.admission import admission
 from workers.event_worker import worker
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     init_db()
-    asyncio.create_task(worker.worker_loop())
+    if settings.INGEST_MODE == "log":
+        # Loads segments left by a previous process before accepting traffic
+        ingest_log.on_loaded = worker.notify
+        await ingest_log.open()
+    await tenant_secrets.reload()
+    await admission.resync()
+    background_tasks = [
+        asyncio.create_task(tenant_secrets.refresh_loop()),
+        asyncio.create_task(admission.resync_loop())
+    ]
+    ingest_writer.start()
+    if settings.EMBEDDED_WORKER:
+        await worker.warm()
+        asyncio.create_task(worker.worker_loop())
     yield
     # Shutdown
-    worker.stop()
+    for task in background_tasks:
+        task.cancel()
+    await ingest_writer.stop()
+    await ingest_log.close()
+    await worker.drain()
+    await worker.aclose()
 
 app = FastAPI(title="Webhook Gateway Validation System", lifespan=lifespan)
 
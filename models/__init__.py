@@ -1,4 +1,4 @@
-from .webhook_models import WebhookEvent, DeadLetterEvent
+from .webhook_models import WebhookEvent, DeadLetterEvent, TenantSecret
 
-__all__ = ["WebhookEvent", "DeadLetterEvent"]
+__all__ = ["WebhookEvent", "DeadLetterEvent", "TenantSecret"]
 
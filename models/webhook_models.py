@@ -1,34 +1,72 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
+from controllers import json_codec
 
 Base = declarative_base()
 
-class WebhookEvent(Base):
+class LazyPayloadMixin:
+    """
+    Exposes `payload` as a view over `raw_body`
+
+    Rows only need the raw body; the parsed payload is decoded on first
+    access and cached on the instance. Rows that have a stored parsed copy
+    (legacy rows, or STORE_PARSED_PAYLOAD enabled) return that instead.
+    """
+    @property
+    def payload(self):
+        if self.stored_payload is not None:
+            return self.stored_payload
+        if self.raw_body is None:
+            return None
+        decoded = getattr(self, "_decoded_payload", None)
+        if decoded is None:
+            decoded = json_codec.loads(self.raw_body)
+            self._decoded_payload = decoded
+        return decoded
+    
+    @payload.setter
+    def payload(self, value):
+        self.stored_payload = value
+
+class WebhookEvent(LazyPayloadMixin, Base):
     __tablename__ = "webhook_events"
+    __table_args__ = (
+        # Serves the worker's per-tenant "pending and due" claims
+        Index("ix_webhook_events_status_tenant_next_attempt", "status", "tenant_id", "next_attempt_at"),
+        # Serves the lease reaper's "processing and expired" scan
+        Index("ix_webhook_events_status_lease_expires_at", "status", "lease_expires_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     tenant_id = Column(String(100), index=True, nullable=True)
     event_type = Column(String(100), index=True)
-    payload = Column(JSON)
+    stored_payload = Column("payload", JSON, nullable=True)  # Parsed copy, only kept if STORE_PARSED_PAYLOAD
     raw_body = Column(Text)  # Original raw body for HMAC verification
     signature = Column(String(255), nullable=True)
-    status = Column(String(50), default="pending")  # pending, processing, delivered, failed
+    forward_headers = Column(JSON, nullable=True)  # Original headers passed through on delivery (FORWARD_HEADERS)
+    outbound_signature = Column(String(100), nullable=True)  # Cached "<key id>:<signature>" of raw_body for delivery
+    idempotency_key = Column(String(64), unique=True, index=True, nullable=True)  # Duplicate-delivery guard
+    status = Column(String(50), default="pending", index=True)  # pending, processing, delivered, failed
     created_at = Column(DateTime, default=datetime.utcnow)
     delivered_at = Column(DateTime, nullable=True)
     retry_count = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)  # When a failed event becomes due for retry
+    lease_owner = Column(String(64), nullable=True)  # Worker that claimed a processing event
+    lease_expires_at = Column(DateTime, nullable=True)
     last_error = Column(Text, nullable=True)
     internal_url = Column(String(500), nullable=True)
 
-class DeadLetterEvent(Base):
+class DeadLetterEvent(LazyPayloadMixin, Base):
     __tablename__ = "dead_letter_events"
     
     id = Column(Integer, primary_key=True, index=True)
     webhook_event_id = Column(Integer, index=True)
     tenant_id = Column(String(100), index=True, nullable=True)
     event_type = Column(String(100))
-    payload = Column(JSON)
+    stored_payload = Column("payload", JSON, nullable=True)
     raw_body = Column(Text)
+    forward_headers = Column(JSON, nullable=True)
     failure_reason = Column(Text)
     retry_count = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -48,3 +86,12 @@ class EventAttempt(Base):
     attempted_at = Column(DateTime, default=datetime.utcnow)
     retry_delay = Column(Integer, nullable=True)  # seconds waited before this attempt
 
+
+class TenantSecret(Base):
+    __tablename__ = "tenant_secrets"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(String(100), index=True)
+    secret = Column(String(255))
+    active = Column(Boolean, default=True)  # Keep old and new active during rotation
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -1,91 +1,114 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException
+from sqlalchemy.orm import Session, defer
 from sqlalchemy import func, desc
-from typing import Optional
+from typing import Optional, Tuple
 from datetime import datetime
 
-from db.database import get_db
+from db.database import run_in_session
+from controllers.json_codec import CodecJSONResponse
+from controllers.admission import admission, BACKLOG_STATUSES
+from controllers.tenant_secrets import tenant_secrets
 from models.webhook_models import WebhookEvent, DeadLetterEvent, EventAttempt
+from workers.event_worker import worker
 
-router = APIRouter()
+router = APIRouter(default_response_class=CodecJSONResponse)
 
-@router.post("/replay/{event_id}")
-async def replay_event(event_id: int, db: Session = Depends(get_db)):
+# List views never show bodies, so don't load them
+_WITHOUT_BODY = (defer(WebhookEvent.raw_body), defer(WebhookEvent.stored_payload))
+
+def _replay(db: Session, event_id: int) -> Tuple[Optional[dict], Optional[str]]:
     """
-    STEP 8: Replay event from dead-letter queue
+    Returns:
+        (response, tenant_id) - tenant_id is set when an event re-entered the backlog
     """
     # Get dead-letter event
     dead_letter = db.query(DeadLetterEvent).filter(
         DeadLetterEvent.id == event_id
     ).first()
-    
+
     if not dead_letter:
         # Try to get from webhook_events if it's a regular event
         event = db.query(WebhookEvent).filter(WebhookEvent.id == event_id).first()
         if not event:
-            raise HTTPException(status_code=404, detail="Event not found")
-        
+            return None, None
+
         # Reset event and requeue
+        requeued = event.status not in BACKLOG_STATUSES
         event.status = "pending"
         event.retry_count = 0
+        event.next_attempt_at = None
         event.last_error = None
         db.commit()
-        db.refresh(event)
-        
+
         # Event is now pending, worker will pick it up
-        return {"status": "replayed", "event_id": event.id}
-    
+        tenant_id = (event.tenant_id or "default") if requeued else None
+        return {"status": "replayed", "event_id": event_id}, tenant_id
+
     # Create new webhook event from dead-letter
     new_event = WebhookEvent(
         tenant_id=dead_letter.tenant_id,
         event_type=dead_letter.event_type,
-        payload=dead_letter.payload,
+        stored_payload=dead_letter.stored_payload,
         raw_body=dead_letter.raw_body,
+        forward_headers=dead_letter.forward_headers,
         status="pending",
         retry_count=0
     )
     db.add(new_event)
-    
+
     # Mark dead-letter as replayed
     dead_letter.replayed = True
     dead_letter.replayed_at = datetime.utcnow()
-    
+
+    db.flush()
+    new_event_id = new_event.id
+    tenant_id = dead_letter.tenant_id or "default"
     db.commit()
-    db.refresh(new_event)
-    
+
     # Event is now pending, worker will pick it up
-    return {"status": "replayed", "event_id": new_event.id, "original_id": dead_letter.id}
+    return (
+        {"status": "replayed", "event_id": new_event_id, "original_id": event_id},
+        tenant_id
+    )
 
-@router.get("/metrics")
-async def get_metrics(
-    tenant_id: Optional[str] = None,
-    db: Session = Depends(get_db)
-):
+@router.post("/replay/{event_id}")
+async def replay_event(event_id: int):
     """
-    STEP 10: Get metrics and logs
+    STEP 8: Replay event from dead-letter queue
     """
+    result, tenant_id = await run_in_session(_replay, event_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if tenant_id is not None:
+        admission.record_accepted(tenant_id)
+        worker.notify(tenant_id)
+    return result
+
+def _metrics(db: Session, tenant_id: Optional[str]) -> dict:
     query = db.query(WebhookEvent)
     if tenant_id:
         query = query.filter(WebhookEvent.tenant_id == tenant_id)
-    
+
     total_events = query.count()
     delivered = query.filter(WebhookEvent.status == "delivered").count()
     failed = query.filter(WebhookEvent.status == "failed").count()
     pending = query.filter(WebhookEvent.status == "pending").count()
     processing = query.filter(WebhookEvent.status == "processing").count()
-    
+
     # Average retry count
     avg_retries = db.query(func.avg(WebhookEvent.retry_count)).scalar() or 0
-    
+
     # Dead-letter count
     dl_query = db.query(DeadLetterEvent)
     if tenant_id:
         dl_query = dl_query.filter(DeadLetterEvent.tenant_id == tenant_id)
     dead_letter_count = dl_query.count()
-    
+
     # Recent events
-    recent_events = query.order_by(desc(WebhookEvent.created_at)).limit(10).all()
-    
+    recent_events = query.options(*_WITHOUT_BODY).order_by(
+        desc(WebhookEvent.created_at)
+    ).limit(10).all()
+
     return {
         "summary": {
             "total_events": total_events,
@@ -110,19 +133,49 @@ async def get_metrics(
         ]
     }
 
-@router.get("/events/{event_id}/attempts")
-async def get_event_attempts(event_id: int, db: Session = Depends(get_db)):
+@router.get("/metrics")
+async def get_metrics(tenant_id: Optional[str] = None):
     """
-    STEP 10: Get attempt history for an event
+    STEP 10: Get metrics and logs
     """
+    return await run_in_session(_metrics, tenant_id)
+
+def _event_detail(db: Session, event_id: int) -> Optional[dict]:
     event = db.query(WebhookEvent).filter(WebhookEvent.id == event_id).first()
     if not event:
+        return None
+
+    return {
+        "id": event.id,
+        "tenant_id": event.tenant_id,
+        "event_type": event.event_type,
+        "status": event.status,
+        "retry_count": event.retry_count,
+        "last_error": event.last_error,
+        "payload": event.payload,
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+        "delivered_at": event.delivered_at.isoformat() if event.delivered_at else None
+    }
+
+@router.get("/events/{event_id}")
+async def get_event(event_id: int):
+    """Get a single event including its decoded payload"""
+    result = await run_in_session(_event_detail, event_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Event not found")
-    
+    return result
+
+def _event_attempts(db: Session, event_id: int) -> Optional[dict]:
+    event = db.query(WebhookEvent).options(*_WITHOUT_BODY).filter(
+        WebhookEvent.id == event_id
+    ).first()
+    if not event:
+        return None
+
     attempts = db.query(EventAttempt).filter(
         EventAttempt.webhook_event_id == event_id
     ).order_by(EventAttempt.attempt_number).all()
-    
+
     return {
         "event_id": event_id,
         "status": event.status,
@@ -140,19 +193,25 @@ async def get_event_attempts(event_id: int, db: Session = Depends(get_db)):
         ]
     }
 
-@router.get("/dead-letters")
-async def get_dead_letters(
-    tenant_id: Optional[str] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db)
-):
-    """Get dead-letter events"""
+@router.get("/events/{event_id}/attempts")
+async def get_event_attempts(event_id: int):
+    """
+    STEP 10: Get attempt history for an event
+    """
+    result = await run_in_session(_event_attempts, event_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return result
+
+def _dead_letters(db: Session, tenant_id: Optional[str], limit: int) -> dict:
     query = db.query(DeadLetterEvent)
     if tenant_id:
         query = query.filter(DeadLetterEvent.tenant_id == tenant_id)
-    
-    dead_letters = query.order_by(desc(DeadLetterEvent.created_at)).limit(limit).all()
-    
+
+    dead_letters = query.options(
+        defer(DeadLetterEvent.raw_body), defer(DeadLetterEvent.stored_payload)
+    ).order_by(desc(DeadLetterEvent.created_at)).limit(limit).all()
+
     return {
         "dead_letters": [
             {
@@ -169,19 +228,23 @@ async def get_dead_letters(
         ]
     }
 
-@router.get("/events")
-async def list_events(
+@router.get("/dead-letters")
+async def get_dead_letters(
     tenant_id: Optional[str] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db)
+    limit: int = 50
 ):
-    """List recent events"""
+    """Get dead-letter events"""
+    return await run_in_session(_dead_letters, tenant_id, limit)
+
+def _list_events(db: Session, tenant_id: Optional[str], limit: int) -> dict:
     query = db.query(WebhookEvent)
     if tenant_id:
         query = query.filter(WebhookEvent.tenant_id == tenant_id)
-    
-    events = query.order_by(desc(WebhookEvent.created_at)).limit(limit).all()
-    
+
+    events = query.options(*_WITHOUT_BODY).order_by(
+        desc(WebhookEvent.created_at)
+    ).limit(limit).all()
+
     return {
         "events": [
             {
@@ -197,3 +260,26 @@ async def list_events(
         ]
     }
 
+@router.get("/events")
+async def list_events(
+    tenant_id: Optional[str] = None,
+    limit: int = 50
+):
+    """List recent events"""
+    return await run_in_session(_list_events, tenant_id, limit)
+
+@router.get("/backlog")
+async def get_backlog():
+    """Current delivery backlog and admission-control state"""
+    return admission.snapshot()
+
+@router.get("/circuits")
+async def get_circuits():
+    """Circuit breaker state per delivery destination"""
+    return worker.breakers.snapshot()
+
+@router.post("/tenant-secrets/reload")
+async def reload_tenant_secrets():
+    """Reload tenant signing secrets now instead of waiting for the refresh interval"""
+    await tenant_secrets.reload()
+    return {"status": "reloaded", "source": tenant_secrets.source}
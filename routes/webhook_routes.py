@@ -1,77 +1,192 @@
-from fastapi import APIRouter, Request, HTTPException, Header, Depends, BackgroundTasks
+from fastapi import APIRouter, Request, HTTPException, Header, BackgroundTasks
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import Optional
-import json
+from typing import Optional, Tuple
+import asyncio
+import math
 
-from db.database import get_db
-from controllers.hmac_verifier import verify_hmac_signature
+from db.batch_writer import ingest_writer
+from db.ingest_log import ingest_log
+from controllers import json_codec
+from controllers.admission import admission
+from controllers.idempotency import idempotency_cache, idempotency_key, EVENT_ID_PENDING
+from controllers.hmac_verifier import (
+    parse_signature, read_verified_body, SignatureError, BodyTooLargeError
+)
 from controllers.rate_limiter import RateLimiter
+from controllers.tenant_secrets import tenant_secrets
+from workers.event_worker import worker
 from models.webhook_models import WebhookEvent
 from config import settings
 
 router = APIRouter()
 rate_limiter = RateLimiter()
 
+def _event_type(payload) -> str:
+    """Read the top-level "type" field of a parsed payload"""
+    if isinstance(payload, dict):
+        event_type = payload.get("type")
+        if isinstance(event_type, str):
+            return event_type[:100]
+    return "unknown"
+
+def _forward_headers(headers) -> Optional[dict]:
+    """The FORWARD_HEADERS present on the request, to be sent on with the event"""
+    forwarded = {name: headers[name] for name in settings.FORWARD_HEADERS if name in headers}
+    return forwarded or None
+
+async def _original_event_id(key: str) -> Optional[int]:
+    """
+    Event id already recorded for an idempotency key, waiting if it's still being written
+
+    Returns EVENT_ID_PENDING if the original is in the ingest log but not yet loaded
+    """
+    cached = idempotency_cache.get(key)
+    if isinstance(cached, asyncio.Future):
+        # None means the first delivery failed to persist; treat this one as new
+        return await asyncio.shield(cached)
+    return cached
+
+async def _store_event(fields: dict) -> Tuple[int, bool]:
+    """
+    Persist an accepted webhook according to INGEST_MODE
+
+    Returns:
+        (event_id, created); event_id is EVENT_ID_PENDING in log mode
+    """
+    if settings.INGEST_MODE == "log":
+        # Durable once fsynced to the ingest log; the loader inserts it later
+        await ingest_log.append(fields)
+        return EVENT_ID_PENDING, True
+    # Group-committed with other concurrent requests; resolves once durable.
+    # created is False if another process already stored this key
+    return await ingest_writer.submit(WebhookEvent(status="pending", **fields))
+
 @router.post("/webhook")
 async def receive_webhook(
     request: Request,
     background_tasks: BackgroundTasks,
     x_signature: Optional[str] = Header(None, alias="X-Signature"),
-    x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID"),
-    db: Session = Depends(get_db)
+    x_tenant_id: Optional[str] = Header(None, alias="X-Tenant-ID")
 ):
     """
     STEP 1 & 2: Receive webhook and verify HMAC signature
     """
-    # Get raw body
-    body = await request.body()
-    body_str = body.decode('utf-8')
+    tenant_id = x_tenant_id or "default"
     
-    # STEP 2: Verify HMAC signature
-    if not verify_hmac_signature(body, x_signature, settings.WEBHOOK_SECRET):
+    # Reject unsigned requests before reading any of the body
+    expected_digest = parse_signature(x_signature)
+    if expected_digest is None:
+        raise HTTPException(status_code=401, detail="Missing or malformed signature")
+    
+    # Shed load while the delivery backlog is above its high-water marks
+    decision = admission.check(tenant_id)
+    if not decision.admitted:
+        raise HTTPException(
+            status_code=503,
+            detail=decision.reason,
+            headers={"Retry-After": str(decision.retry_after)}
+        )
+    
+    max_body_bytes = settings.TENANT_MAX_BODY_BYTES.get(tenant_id, settings.MAX_BODY_BYTES)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body_bytes:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    
+    # STEP 2: Stream the body through the HMAC, keeping it only if it verifies
+    try:
+        body = await read_verified_body(
+            request.stream(),
+            expected_digest,
+            tenant_secrets.secrets_for(tenant_id),
+            max_body_bytes
+        )
+    except BodyTooLargeError:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    except SignatureError:
         raise HTTPException(status_code=401, detail="Invalid signature")
     
     # STEP 9: Rate limiting
-    tenant_id = x_tenant_id or "default"
-    is_allowed, remaining = rate_limiter.check_rate_limit(tenant_id)
-    if not is_allowed:
+    rate = await rate_limiter.check_rate_limit_async(tenant_id)
+    rate_headers = {
+        "X-RateLimit-Limit": str(rate.limit),
+        "X-RateLimit-Remaining": str(rate.remaining),
+        "X-RateLimit-Reset": str(math.ceil(rate.reset_after))
+    }
+    if not rate.allowed:
         raise HTTPException(
             status_code=429,
-            detail=f"Rate limit exceeded. Limit: {settings.DEFAULT_RATE_LIMIT}/sec"
+            detail=f"Rate limit exceeded. Limit: {rate.limit}/sec",
+            headers={**rate_headers, "Retry-After": str(max(1, math.ceil(rate.retry_after)))}
         )
     
+    # Duplicate suppression: retried deliveries get the original event id
+    # back without a new row or a second forward
+    key = idempotency_key(tenant_id, request.headers, body)
+    if key is not None:
+        original_id = await _original_event_id(key)
+        if original_id is not None:
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "status": "duplicate",
+                    "event_id": original_id or None,
+                    "rate_limit_remaining": rate.remaining
+                },
+                headers=rate_headers
+            )
+    
     # Parse payload
     try:
-        payload = json.loads(body_str)
-    except json.JSONDecodeError:
+        payload = json_codec.loads(body)
+        body_str = body.decode('utf-8')
+    except (json_codec.JSONDecodeError, UnicodeDecodeError):
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
     
-    event_type = payload.get("type", "unknown")
+    event_type = _event_type(payload)
     
-    # STEP 3: Save to database
-    webhook_event = WebhookEvent(
+    # STEP 3: Save to database. Only the raw body is stored by default; the
+    # parsed payload is decoded lazily by admin views that need it
+    fields = dict(
         tenant_id=tenant_id,
         event_type=event_type,
-        payload=payload,
+        stored_payload=payload if settings.STORE_PARSED_PAYLOAD else None,
         raw_body=body_str,
         signature=x_signature,
-        status="pending",
+        forward_headers=_forward_headers(request.headers),
+        idempotency_key=key,
         internal_url=settings.INTERNAL_WEBHOOK_URL
     )
-    db.add(webhook_event)
-    db.commit()
-    db.refresh(webhook_event)
+    # Concurrent duplicates of this key wait on in_flight for our event id
+    in_flight = None
+    if key is not None:
+        in_flight = asyncio.get_running_loop().create_future()
+        idempotency_cache.put(key, in_flight)
+    
+    try:
+        event_id, created = await _store_event(fields)
+    except BaseException:
+        if in_flight is not None:
+            idempotency_cache.discard(key)
+            in_flight.set_result(None)
+        raise
     
-    # STEP 4: Event is saved with status "pending", worker will pick it up
-    # No need to explicitly queue - worker polls database
+    if in_flight is not None:
+        idempotency_cache.put(key, event_id)
+        in_flight.set_result(event_id)
+    if created:
+        admission.record_accepted(tenant_id)
+        # STEP 4: Event is saved with status "pending"; hand it to the worker
+        # now rather than at its next poll (log mode notifies once loaded)
+        if event_id:
+            worker.notify(tenant_id)
     
     return JSONResponse(
         status_code=200,
         content={
-            "status": "received",
-            "event_id": webhook_event.id,
-            "rate_limit_remaining": remaining
-        }
+            "status": "received" if created else "duplicate",
+            "event_id": event_id or None,
+            "rate_limit_remaining": rate.remaining
+        },
+        headers=rate_headers
     )
 
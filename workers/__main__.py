@@ -0,0 +1,71 @@
+"""
+Standalone delivery worker
+
+Run with: python -m workers [--processes N]
+
+Starts N delivery processes, each with its own event loop and HTTP pools.
+They coordinate only through the database: claims are atomic and leased,
+so any number of these (and any API processes with EMBEDDED_WORKER on)
+can share one database. Pair with EMBEDDED_WORKER=false on the API so
+ingest and delivery don't compete for the same event loop.
+"""
+import argparse
+import multiprocessing
+import signal
+import time
+from workers.runner import run_process
+from config import settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook delivery worker")
+    parser.add_argument(
+        "--processes", "-n",
+        type=int,
+        default=settings.WORKER_PROCESSES,
+        help="number of delivery processes (default: WORKER_PROCESSES)"
+    )
+    args = parser.parse_args()
+
+    from db.database import init_db
+    init_db()
+
+    if args.processes <= 1:
+        run_process()
+        return
+
+    # spawn, so each process opens its own database connections and lease id
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    def _start():
+        process = context.Process(target=run_process, name="delivery-worker")
+        process.start()
+        return process
+
+    processes = [_start() for _ in range(args.processes)]
+    print(f"Started {len(processes)} delivery worker processes")
+
+    # Replace processes that die
+    while not stopping:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                print(f"Delivery worker {process.pid} exited with {process.exitcode}; restarting")
+                processes[i] = _start()
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()  # SIGTERM: the worker drains in-flight deliveries and exits
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Batched delivery for destinations that accept arrays of events
+Concurrent deliveries to the same internal_url are coalesced into one POST
+whose body is a JSON array of payloads
+"""
+import asyncio
+from typing import Callable, List, Tuple
+import httpx
+from controllers import json_codec
+from controllers.batch_queue import BatchQueue
+from controllers.hmac_verifier import sign_body
+from workers.delivery_response import DeliveryResult, read_prefix, stored_success_body
+from workers.retry_policy import RETRY_AFTER_STATUSES, parse_retry_after
+from config import settings
+
+def split_batch_response(response: httpx.Response, content: bytes, count: int) -> List[DeliveryResult]:
+    """
+    Per-event results of a batch request
+
+    A non-2xx response fails every event. A 2xx (or 207) response may carry
+    {"results": [...]} aligned with the request array, where each item is a
+    status code or {"status": code, "error": "..."}; events are then
+    judged individually. Any other 2xx body means all were accepted.
+
+    content is the body as read: up to BATCH_DELIVERY_RESULTS_MAX_BYTES for
+    a 2xx, so results can be parsed (a longer body fails to parse and counts
+    as plain acceptance), else the usual DELIVERY_RESPONSE_MAX_BYTES prefix.
+    """
+    whole = DeliveryResult.from_response(response, content)
+    if not whole.success:
+        return [whole] * count
+
+    try:
+        body = json_codec.loads(content)
+    except json_codec.JSONDecodeError:
+        body = None
+    items = body.get("results") if isinstance(body, dict) else None
+    if not isinstance(items, list) or len(items) != count:
+        return [whole] * count
+
+    results = []
+    for item in items:
+        status = item.get("status") if isinstance(item, dict) else item
+        if not isinstance(status, int):
+            status = response.status_code
+        detail = item.get("error") if isinstance(item, dict) else None
+        if 200 <= status < 300:
+            results.append(DeliveryResult(True, status, stored_success_body(json_codec.dumps_str(item)), None))
+        else:
+            error = f"HTTP {status} in batch" + (f": {str(detail)[:500]}" if detail else "")
+            retry_after = None
+            if status in RETRY_AFTER_STATUSES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            item_body = json_codec.dumps_str(item)[:settings.DELIVERY_RESPONSE_MAX_BYTES]
+            results.append(DeliveryResult(False, status, item_body, error, retry_after))
+    return results
+
+class DeliveryBatcher:
+    """
+    Coalesces deliveries to one destination into array requests
+
+    Batches are signed as a whole; per-event passed-through headers aren't
+    sent, since one request carries many events.
+
+    The first delivery opens a window of BATCH_DELIVERY_MAX_WAIT_MS; the
+    batch is sent when it reaches BATCH_DELIVERY_MAX_EVENTS or the window
+    closes. Each caller's submit() resolves with its own DeliveryResult.
+    Event ids are sent in X-Event-IDs, in array order.
+    """
+    def __init__(
+        self,
+        url: str,
+        get_client: Callable[[str], httpx.AsyncClient],
+        record_destination: Callable[[str, bool], None]
+    ):
+        self.url = url
+        self.get_client = get_client
+        self.record_destination = record_destination
+        self.max_events = max(1, settings.BATCH_DELIVERY_MAX_EVENTS)
+        self.max_wait = settings.BATCH_DELIVERY_MAX_WAIT_MS / 1000
+        self._batches = BatchQueue(self._dispatch, self.max_events, self.max_wait)
+        self._sending = set()
+
+    async def submit(self, delivery: dict) -> DeliveryResult:
+        """Queue a delivery for the next batch and wait for its result"""
+        return await self._batches.submit(delivery)
+
+    async def _dispatch(self, batch: List[Tuple[dict, asyncio.Future]]):
+        # Sent concurrently so a slow request doesn't hold back the next batch
+        task = asyncio.create_task(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[dict, asyncio.Future]]):
+        """POST one batch and resolve each caller with its result"""
+        # Callers cancelled while queued (worker drain) have been released already
+        batch = [(delivery, future) for delivery, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        deliveries = [delivery for delivery, _ in batch]
+        # Each raw body is a JSON document, so joining them forms the array
+        # without decoding or re-encoding any payload
+        body = b"[" + b",".join(delivery["body"] for delivery in deliveries) + b"]"
+        headers = {
+            "Content-Type": "application/json",
+            "X-Event-IDs": ",".join(str(d["event_id"]) for d in deliveries)
+        }
+        if settings.OUTBOUND_SIGNING_SECRET:
+            headers[settings.OUTBOUND_SIGNATURE_HEADER] = sign_body(
+                settings.OUTBOUND_SIGNING_SECRET, body
+            )
+        try:
+            async with self.get_client(self.url).stream(
+                "POST", self.url, content=body, headers=headers
+            ) as response:
+                # Only a 2xx body is parsed for per-event results; error
+                # pages are read no further than for single deliveries
+                limit = None
+                if response.is_success:
+                    limit = settings.BATCH_DELIVERY_RESULTS_MAX_BYTES
+                content = await read_prefix(response, limit)
+        except Exception as e:
+            self.record_destination(self.url, False)
+            results = [DeliveryResult.from_error(e)] * len(batch)
+        else:
+            self.record_destination(self.url, response.status_code < 500)
+            try:
+                results = split_batch_response(response, content, len(batch))
+            except Exception as e:
+                results = [DeliveryResult.from_error(e)] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def stop(self):
+        """Stop batching after sending everything already queued"""
+        await self._batches.stop()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
@@ -0,0 +1,130 @@
+"""
+Circuit breakers for delivery destinations
+Stops dispatching to an internal_url that keeps failing, and lets a single
+probe request decide when it is healthy again
+"""
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set
+from config import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a window of recent outcomes
+
+    Closed: deliveries flow; the breaker opens once at least
+    CIRCUIT_MIN_REQUESTS of the last CIRCUIT_WINDOW_SIZE attempts were
+    made and CIRCUIT_FAILURE_RATE of them failed.
+    Open: nothing is dispatched for CIRCUIT_OPEN_SECONDS, and after that
+    until an event for the destination is due to serve as the probe.
+    Half-open: exactly one probe is in flight; its success closes the
+    breaker, its failure opens it again. Other outcomes (from deliveries
+    already in flight when the breaker opened) are ignored.
+    """
+    def __init__(self):
+        self.state = CLOSED
+        self._outcomes: "deque[bool]" = deque(maxlen=settings.CIRCUIT_WINDOW_SIZE)
+        self._failures = 0
+        self._open_until = 0.0
+        self.opened_count = 0
+
+    def _open(self):
+        self.state = OPEN
+        self._open_until = time.monotonic() + settings.CIRCUIT_OPEN_SECONDS
+        self._outcomes.clear()
+        self._failures = 0
+        self.opened_count += 1
+
+    def probe_ready(self) -> bool:
+        """True once an open breaker may send its probe"""
+        return self.state == OPEN and time.monotonic() >= self._open_until
+
+    def start_probe(self):
+        self.state = HALF_OPEN
+
+    def wait_for_probe(self, seconds: float):
+        """Stay open: no event was due to probe with, try again in `seconds`"""
+        self._open_until = time.monotonic() + seconds
+
+    def close(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+    def record(self, success: bool, probe: bool = False) -> bool:
+        """
+        Record the outcome of a delivery attempt
+
+        Returns:
+            True if this outcome closed a half-open breaker
+        """
+        if self.state == HALF_OPEN:
+            if not probe:
+                return False
+            if success:
+                self.state = CLOSED
+                return True
+            self._open()
+            return False
+        if self.state == OPEN:
+            # Attempts that were already in flight when the breaker opened
+            return False
+
+        if len(self._outcomes) == self._outcomes.maxlen and not self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(success)
+        if not success:
+            self._failures += 1
+        if (
+            len(self._outcomes) >= settings.CIRCUIT_MIN_REQUESTS
+            and self._failures >= settings.CIRCUIT_FAILURE_RATE * len(self._outcomes)
+        ):
+            self._open()
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self._open_until - time.monotonic())
+
+class CircuitBreakers:
+    """Breaker per destination URL, created on first use"""
+    def __init__(self):
+        self.enabled = settings.CIRCUIT_BREAKER_ENABLED
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            breaker = self._breakers[url] = CircuitBreaker()
+        return breaker
+
+    def record(self, url: str, success: bool, probe: bool = False) -> bool:
+        """Record an outcome for url; True if it closed a half-open breaker"""
+        if not self.enabled:
+            return False
+        return self.get(url).record(success, probe)
+
+    def blocked_urls(self) -> Set[str]:
+        """Destinations that must not be claimed for (open or probing)"""
+        return {url for url, breaker in self._breakers.items() if breaker.state != CLOSED}
+
+    def probe_ready(self) -> List[str]:
+        return [url for url, breaker in self._breakers.items() if breaker.probe_ready()]
+
+    def next_probe_in(self) -> Optional[float]:
+        """Seconds until the earliest open breaker may probe, or None if none is open"""
+        waits = [breaker.retry_after() for breaker in self._breakers.values() if breaker.state == OPEN]
+        return min(waits) if waits else None
+
+    def snapshot(self) -> dict:
+        return {
+            url: {
+                "state": breaker.state,
+                "retry_after": round(breaker.retry_after(), 1) if breaker.state == OPEN else 0,
+                "times_opened": breaker.opened_count
+            }
+            for url, breaker in self._breakers.items()
+        }
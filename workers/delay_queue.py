@@ -0,0 +1,53 @@
+"""
+In-process delay queue for scheduled retries
+A min-heap of (due time, tenant id) that wakes exactly when the earliest
+retry is due, so waiting events hold no task, session or worker slot
+"""
+import asyncio
+import heapq
+import time
+from typing import List, Optional, Tuple
+
+class DelayQueue:
+    """
+    Tenants keyed by the monotonic time one of their retries becomes due
+
+    The database's next_attempt_at stays the source of truth; this queue
+    only tells the worker which tenant to claim for, and when, so it
+    doesn't have to poll for retries it scheduled itself.
+    """
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._changed: Optional[asyncio.Event] = None
+
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def schedule(self, tenant_id: str, delay: float):
+        """Make tenant_id due in `delay` seconds"""
+        heapq.heappush(self._heap, (time.monotonic() + delay, tenant_id))
+        # Wake the waiter in case this is now the earliest entry
+        self._event().set()
+
+    async def next_due(self) -> str:
+        """Wait for the earliest entry to become due and remove it"""
+        changed = self._event()
+        while True:
+            changed.clear()
+            if self._heap:
+                due_at, tenant_id = self._heap[0]
+                timeout = due_at - time.monotonic()
+                if timeout <= 0:
+                    heapq.heappop(self._heap)
+                    return tenant_id
+            else:
+                timeout = None
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._heap)
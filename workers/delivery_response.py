@@ -0,0 +1,70 @@
+"""
+Outcome of a delivery attempt, built from a bounded read of the response
+Destination responses are stored with each attempt, so only a capped prefix
+is ever downloaded and decoded
+"""
+from typing import NamedTuple, Optional
+import httpx
+from workers.retry_policy import RETRY_AFTER_STATUSES, parse_retry_after
+from config import settings
+
+def decode_prefix(body: bytes, encoding: Optional[str] = None) -> str:
+    """Text of the first DELIVERY_RESPONSE_MAX_BYTES of a response body"""
+    prefix = body[:settings.DELIVERY_RESPONSE_MAX_BYTES]
+    try:
+        return prefix.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        # Unknown charset in Content-Type
+        return prefix.decode("utf-8", errors="replace")
+
+def stored_success_body(text: str) -> Optional[str]:
+    if not settings.STORE_SUCCESS_RESPONSE_BODY:
+        return None
+    return text[:settings.DELIVERY_RESPONSE_MAX_BYTES]
+
+async def read_prefix(response: httpx.Response, limit: Optional[int] = None) -> bytes:
+    """
+    Read at most `limit` (default DELIVERY_RESPONSE_MAX_BYTES) bytes of a streamed response
+
+    Whatever is left is never downloaded; closing the stream then drops the
+    connection instead of returning it to the pool.
+    """
+    if limit is None:
+        limit = settings.DELIVERY_RESPONSE_MAX_BYTES
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    return b"".join(chunks)[:limit]
+
+class DeliveryResult(NamedTuple):
+    """Outcome of delivering one event"""
+    success: bool
+    status_code: Optional[int]
+    response_body: Optional[str]
+    error: Optional[str]
+    retry_after: Optional[float] = None  # seconds the destination asked us to wait
+
+    @classmethod
+    def from_response(cls, response: httpx.Response, body: bytes) -> "DeliveryResult":
+        """Result of a response whose body (or its first bytes) has been read"""
+        text = decode_prefix(body, response.charset_encoding)
+        if response.is_success:
+            return cls(True, response.status_code, stored_success_body(text), None)
+        retry_after = None
+        if response.status_code in RETRY_AFTER_STATUSES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return cls(
+            False,
+            response.status_code,
+            text,
+            f"HTTP {response.status_code}: {text[:500]}",
+            retry_after
+        )
+
+    @classmethod
+    def from_error(cls, error: Exception) -> "DeliveryResult":
+        return cls(False, None, None, str(error))
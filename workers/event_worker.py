@@ -1,142 +1,845 @@
 """
 Simple background worker for processing webhook events
-Uses asyncio to poll database and process events
+Uses asyncio to claim due events from the database and deliver them
 """
 import asyncio
-import httpx
+import hashlib
+import os
+import socket
+import sys
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import and_, or_, select, update
 from sqlalchemy.orm import Session
-from db.database import SessionLocal
+from db.database import run_in_session
+from controllers import json_codec
+from controllers.admission import admission
+from controllers.hmac_verifier import sign_body
 from models.webhook_models import WebhookEvent, DeadLetterEvent, EventAttempt
+from workers.batch_delivery import DeliveryBatcher
+from workers.circuit_breaker import CircuitBreakers
+from workers.delay_queue import DelayQueue
+from workers.delivery_response import DeliveryResult, read_prefix
+from workers.http_clients import DestinationClients
+from workers.retry_policy import retry_policy_for
 from config import settings
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# Database steps of a delivery. Each runs on the DB executor with its own
+# short-lived session, so no connection is held while awaiting the HTTP call.
+
+# Columns a claim returns; enough to deliver without loading the ORM object
+_CLAIM_COLUMNS = (
+    WebhookEvent.id,
+    WebhookEvent.tenant_id,
+    WebhookEvent.internal_url,
+    WebhookEvent.stored_payload,
+    WebhookEvent.raw_body,
+    WebhookEvent.forward_headers,
+    WebhookEvent.outbound_signature,
+    WebhookEvent.retry_count
+)
+
+def _delivery_from_row(row) -> dict:
+    (event_id, tenant_id, internal_url, stored_payload, raw_body,
+     forward_headers, outbound_signature, retry_count) = row
+    # The original bytes are forwarded as received; only rows from before
+    # raw bodies were kept need their payload encoded
+    if raw_body is not None:
+        body = raw_body.encode("utf-8")
+    else:
+        body = json_codec.dumps(stored_payload)
+    return {
+        "event_id": event_id,
+        "tenant_id": tenant_id or "default",
+        "url": internal_url or settings.INTERNAL_WEBHOOK_URL,
+        "body": body,
+        "headers": forward_headers or {},
+        "signature": outbound_signature,
+        "attempt_number": retry_count + 1
+    }
+
+def _due_filter(now: datetime):
+    return (
+        WebhookEvent.status == "pending",
+        or_(
+            WebhookEvent.next_attempt_at.is_(None),
+            WebhookEvent.next_attempt_at <= now
+        )
+    )
+
+def _tenant_filter(tenant_id: str):
+    # Events stored without a tenant belong to "default", like the route's fallback
+    if tenant_id == "default":
+        return or_(WebhookEvent.tenant_id == tenant_id, WebhookEvent.tenant_id.is_(None))
+    return WebhookEvent.tenant_id == tenant_id
+
+def _url_filter(url: str):
+    # Events stored without a URL go to INTERNAL_WEBHOOK_URL
+    if url == settings.INTERNAL_WEBHOOK_URL:
+        return or_(WebhookEvent.internal_url == url, WebhookEvent.internal_url.is_(None))
+    return WebhookEvent.internal_url == url
+
+def _destination_filter(blocked_urls: Set[str]):
+    """Excludes events for any of blocked_urls"""
+    allowed = WebhookEvent.internal_url.notin_(blocked_urls)
+    if settings.INTERNAL_WEBHOOK_URL in blocked_urls:
+        return and_(WebhookEvent.internal_url.isnot(None), allowed)
+    return or_(WebhookEvent.internal_url.is_(None), allowed)
+
+def _due_tenants(db: Session, limit: int, after: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+    """
+    One page of tenants that currently have due pending events, in tenant_id order
+
+    Returns:
+        (tenants, cursor) - pass cursor as `after` to read the next page;
+        it is None after the last page, so the following scan starts over
+    """
+    query = db.query(WebhookEvent.tenant_id).filter(*_due_filter(datetime.utcnow()))
+    if after is not None:
+        query = query.filter(WebhookEvent.tenant_id > after)
+    rows = query.distinct().order_by(WebhookEvent.tenant_id).limit(limit).all()
+    cursor = rows[-1].tenant_id if len(rows) == limit else None
+    return list({row.tenant_id or "default" for row in rows}), cursor
+
+def _claim(db: Session, owner: str, limit: int, *criteria) -> List[dict]:
+    """
+    Atomically move up to `limit` due events matching criteria to processing under a lease
+
+    Uses a single UPDATE ... RETURNING where the dialect supports it (SQLite
+    serializes it behind the write lock; PostgreSQL skips rows locked by
+    other claimers). MySQL has no UPDATE ... RETURNING, so rows are locked
+    with SELECT ... FOR UPDATE SKIP LOCKED, updated and read back in the
+    same transaction. Either way, concurrent workers never claim the same
+    event. The caller commits.
+
+    Returns:
+        One delivery dict per claimed event
+    """
+    now = datetime.utcnow()
+    due = select(WebhookEvent.id).where(
+        *_due_filter(now), *criteria
+    ).order_by(WebhookEvent.id).limit(limit).with_for_update(skip_locked=True)
+    claim = {
+        "status": "processing",
+        "lease_owner": owner,
+        "lease_expires_at": now + timedelta(seconds=settings.WORKER_LEASE_SECONDS)
+    }
+
+    if db.get_bind().dialect.update_returning:
+        rows = db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id.in_(due.scalar_subquery()), WebhookEvent.status == "pending")
+            .values(**claim)
+            .returning(*_CLAIM_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+    else:
+        ids = db.scalars(due).all()
+        rows = []
+        if ids:
+            db.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id.in_(ids))
+                .values(**claim)
+                .execution_options(synchronize_session=False)
+            )
+            rows = db.execute(select(*_CLAIM_COLUMNS).where(WebhookEvent.id.in_(ids))).all()
+
+    return [_delivery_from_row(row) for row in rows]
+
+def _claim_for_tenants(
+    db: Session,
+    owner: str,
+    plan: Dict[str, int],
+    blocked_urls: Set[str]
+) -> Dict[str, List[dict]]:
+    """
+    Claim up to plan[tenant] events for each tenant in one transaction
+
+    Events for blocked_urls (destinations with an open circuit) are left pending.
+    """
+    criteria = (_destination_filter(blocked_urls),) if blocked_urls else ()
+    claimed = {
+        tenant_id: _claim(db, owner, limit, _tenant_filter(tenant_id), *criteria)
+        for tenant_id, limit in plan.items()
+    }
+    db.commit()
+    return claimed
+
+def _claim_probe(db: Session, owner: str, url: str) -> Optional[dict]:
+    """Claim one due event for url, used as a circuit breaker's probe"""
+    claimed = _claim(db, owner, 1, _url_filter(url))
+    db.commit()
+    return claimed[0] if claimed else None
+
+def _extend_leases(db: Session, owner: str, event_ids: List[int]):
+    """Heartbeat: push back the lease expiry of events this worker is still delivering"""
+    db.query(WebhookEvent).filter(
+        WebhookEvent.id.in_(event_ids),
+        WebhookEvent.lease_owner == owner,
+        WebhookEvent.status == "processing"
+    ).update(
+        {"lease_expires_at": datetime.utcnow() + timedelta(seconds=settings.WORKER_LEASE_SECONDS)},
+        synchronize_session=False
+    )
+    db.commit()
+
+_LEASE_EXPIRED = "Lease expired before the delivery finished"
+
+def _reap_expired_leases(db: Session, limit: int) -> List[Tuple[str, Optional[float]]]:
+    """
+    Fail up to `limit` processing events whose lease expired
+
+    Their worker died (or stalled past its lease) mid-delivery, so the
+    attempt counts as failed like any other: the event is retried after
+    its RetryPolicy delay, or dead-lettered once out of attempts.
+    Processing rows without a lease predate leases and are treated as
+    expired.
+
+    Rows are first taken over by a conditional UPDATE under a one-off owner
+    name, so when reapers race (SQLite ignores SKIP LOCKED) each expired
+    event is failed by exactly one of them.
+
+    Returns:
+        (tenant_id, retry delay or None if dead-lettered) per event
+    """
+    now = datetime.utcnow()
+    expired = (
+        WebhookEvent.status == "processing",
+        or_(WebhookEvent.lease_expires_at < now, WebhookEvent.lease_expires_at.is_(None))
+    )
+    ids = db.scalars(
+        select(WebhookEvent.id).where(*expired).limit(limit).with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        return []
+
+    reaper = f"reaper:{uuid.uuid4().hex}"[:64]
+    db.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_(ids), *expired)
+        .values(lease_owner=reaper, lease_expires_at=now + timedelta(seconds=settings.WORKER_LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    events = db.scalars(select(WebhookEvent).where(WebhookEvent.lease_owner == reaper)).all()
+
+    outcomes = []
+    for event in events:
+        attempt = EventAttempt(
+            webhook_event_id=event.id,
+            attempt_number=event.retry_count + 1,
+            status="failed",
+            error_message=_LEASE_EXPIRED
+        )
+        db.add(attempt)
+        outcomes.append((event.tenant_id or "default", _fail_event(db, event, attempt, _LEASE_EXPIRED)))
+    db.commit()
+    return outcomes
+
+def _release_claims(db: Session, owner: str) -> int:
+    """
+    Shutdown: hand every event this worker still holds back to pending
+
+    No attempt is counted, and the events are due right away for any other worker.
+    """
+    released = db.query(WebhookEvent).filter(
+        WebhookEvent.status == "processing",
+        WebhookEvent.lease_owner == owner
+    ).update(
+        {"status": "pending", "lease_owner": None, "lease_expires_at": None},
+        synchronize_session=False
+    )
+    db.commit()
+    return released
+
+def _holds_lease(owner: str):
+    """Filters to events still processing under owner's lease"""
+    return WebhookEvent.status == "processing", WebhookEvent.lease_owner == owner
+
+def _record_success(
+    db: Session,
+    owner: str,
+    event_id: int,
+    attempt_number: int,
+    response_code: int,
+    response_body: str
+) -> bool:
+    """
+    Record a successful attempt and mark the event delivered
+
+    Returns:
+        False, writing nothing, if owner's lease was lost (reaped or released)
+    """
+    delivered = db.query(WebhookEvent).filter(WebhookEvent.id == event_id, *_holds_lease(owner)).update(
+        {
+            "status": "delivered",
+            "delivered_at": datetime.utcnow(),
+            "lease_owner": None,
+            "lease_expires_at": None
+        },
+        synchronize_session=False
+    )
+    if not delivered:
+        db.rollback()
+        return False
+    db.add(EventAttempt(
+        webhook_event_id=event_id,
+        attempt_number=attempt_number,
+        status="success",
+        response_code=response_code,
+        response_body=response_body
+    ))
+    db.commit()
+    return True
+
+def _record_failure(
+    db: Session,
+    owner: str,
+    event_id: int,
+    attempt_number: int,
+    error: str,
+    response_code: Optional[int] = None,
+    response_body: Optional[str] = None,
+    outbound_signature: Optional[str] = None,
+    retry_after: Optional[float] = None
+) -> Optional[float]:
+    """
+    Record a failed attempt and either schedule a retry or dead-letter the event
+
+    The delay comes from the event's RetryPolicy; retry_after is the wait a
+    429/503 response asked for. outbound_signature is kept so retries (in
+    any worker) don't re-sign the body.
+
+    Returns:
+        (recorded, delay) - recorded is False, with nothing written, if
+        owner's lease was lost; delay is the retry delay in seconds, or
+        None if the event was moved to dead-letter
+    """
+    # The conditional UPDATE checks the lease and holds the row (and on
+    # SQLite the write lock) until commit, so the reaper can't take it over
+    # between the check and the writes below
+    held = db.query(WebhookEvent).filter(WebhookEvent.id == event_id, *_holds_lease(owner)).update(
+        {"lease_expires_at": datetime.utcnow() + timedelta(seconds=settings.WORKER_LEASE_SECONDS)},
+        synchronize_session=False
+    )
+    if not held:
+        db.rollback()
+        return False, None
+    event = db.query(WebhookEvent).filter(WebhookEvent.id == event_id).one()
+
+    attempt = EventAttempt(
+        webhook_event_id=event_id,
+        attempt_number=attempt_number,
+        status="failed",
+        response_code=response_code,
+        response_body=response_body,
+        error_message=error[:1000]
+    )
+    db.add(attempt)
+    if outbound_signature:
+        event.outbound_signature = outbound_signature
+    delay = _fail_event(db, event, attempt, error, retry_after)
+    db.commit()
+    return True, delay
+
+def _fail_event(
+    db: Session,
+    event: WebhookEvent,
+    attempt: EventAttempt,
+    error: str,
+    retry_after: Optional[float] = None
+) -> Optional[float]:
+    """
+    Count a failed attempt against event and schedule its retry or dead-letter it (no commit)
+
+    Returns:
+        Retry delay in seconds, or None if the event was moved to dead-letter
+    """
+    event.retry_count += 1
+    event.last_error = error[:500]
+    event.lease_owner = None
+    event.lease_expires_at = None
+
+    policy = retry_policy_for(event.tenant_id, event.internal_url)
+    if event.retry_count < policy.max_attempts:
+        previous_delay = None
+        if policy.jitter == "decorrelated":
+            previous_delay = db.query(EventAttempt.retry_delay).filter(
+                EventAttempt.webhook_event_id == event.id,
+                EventAttempt.retry_delay.isnot(None)
+            ).order_by(EventAttempt.id.desc()).limit(1).scalar()
+        delay = policy.delay(event.retry_count, previous_delay, retry_after)
+        attempt.retry_delay = round(delay)
+        event.status = "pending"  # Reset to pending for retry
+        event.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        return delay
+
+    # Move to dead-letter queue
+    event.status = "failed"
+    db.add(DeadLetterEvent(
+        webhook_event_id=event.id,
+        tenant_id=event.tenant_id,
+        event_type=event.event_type,
+        stored_payload=event.stored_payload,
+        raw_body=event.raw_body,
+        forward_headers=event.forward_headers,
+        failure_reason=error[:1000],
+        retry_count=event.retry_count
+    ))
+    return None
+
+# Identifies the outbound secret a cached signature was made with
+_SIGNING_KEY_ID = hashlib.sha256(settings.OUTBOUND_SIGNING_SECRET.encode("utf-8")).hexdigest()[:8]
+
+def _outbound_headers(delivery: dict) -> dict:
+    """
+    Headers for a single-event delivery: passed-through originals plus our signature
+
+    The signature is computed on the first attempt and cached on the
+    delivery (persisted with a failed attempt), so retries reuse it as long
+    as OUTBOUND_SIGNING_SECRET is unchanged.
+    """
+    headers = {"Content-Type": "application/json", **delivery["headers"]}
+    secret = settings.OUTBOUND_SIGNING_SECRET
+    if secret:
+        cached = delivery["signature"]
+        prefix = _SIGNING_KEY_ID + ":"
+        if cached and cached.startswith(prefix):
+            signature = cached[len(prefix):]
+        else:
+            signature = sign_body(secret, delivery["body"])
+            delivery["signature"] = prefix + signature
+        headers[settings.OUTBOUND_SIGNATURE_HEADER] = signature
+    return headers
+
+# Upper bound on tenants read by one safety-net scan
+_TENANT_SCAN_LIMIT = 1000
+# Rows touched per lease reaper or heartbeat statement
+_LEASE_BATCH = 500
+
+def _lease_lost(event_id: int):
+    # The event belongs to whoever reaped or re-claimed it now
+    print(f"Lease on event {event_id} expired before its outcome was recorded; outcome dropped")
+
+def _worker_id() -> str:
+    """Lease owner name, unique per worker process"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[-64:]
+
+class FairScheduler:
+    """
+    Weighted deficit round robin over tenants with due events
+
+    Each pass over the active tenants adds a tenant's weight (TENANT_WEIGHTS,
+    default 1) to its deficit, and the tenant may claim as many whole events
+    as its deficit covers, up to its concurrency cap (TENANT_MAX_IN_FLIGHT,
+    else WORKER_TENANT_MAX_IN_FLIGHT; 0 means no cap). Free slots are
+    therefore shared in proportion to weight no matter how deep any one
+    tenant's backlog is, and a tenant with a single new event gets a slot
+    within one pass. A tenant leaves the rotation (and forfeits its deficit)
+    once a claim comes back short, i.e. it has nothing more due.
+    """
+    def __init__(self):
+        self.default_cap = settings.WORKER_TENANT_MAX_IN_FLIGHT
+        self.caps = settings.TENANT_MAX_IN_FLIGHT
+        # A weight of zero would never accumulate a whole event
+        self.weights = {tenant: max(weight, 0.01) for tenant, weight in settings.TENANT_WEIGHTS.items()}
+        self._active: "OrderedDict[str, float]" = OrderedDict()  # tenant -> deficit, in visiting order
+        self._in_flight: Dict[str, int] = defaultdict(int)
+    
+    def activate(self, tenant_id: str):
+        """Add a tenant that has (or may have) due events to the rotation"""
+        if tenant_id not in self._active:
+            self._active[tenant_id] = 0.0
+    
+    def _headroom(self, tenant_id: str) -> int:
+        cap = self.caps.get(tenant_id, self.default_cap)
+        if cap <= 0:
+            return sys.maxsize
+        return cap - self._in_flight[tenant_id]
+    
+    def plan(self, free: int) -> Dict[str, int]:
+        """Split `free` delivery slots between active tenants"""
+        plan: Dict[str, int] = {}
+        while free > 0:
+            visited = []
+            progressed = False
+            for tenant_id in self._active:
+                visited.append(tenant_id)
+                headroom = self._headroom(tenant_id) - plan.get(tenant_id, 0)
+                if headroom <= 0:
+                    continue
+                progressed = True
+                deficit = self._active[tenant_id] + self.weights.get(tenant_id, 1)
+                count = min(int(deficit), headroom, free)
+                self._active[tenant_id] = deficit - count
+                if count:
+                    plan[tenant_id] = plan.get(tenant_id, 0) + count
+                    free -= count
+                    if free == 0:
+                        break
+            if free == 0:
+                # The next plan resumes with the tenant after the last one served
+                for tenant_id in visited:
+                    self._active.move_to_end(tenant_id)
+            if not progressed:
+                break
+        return plan
+    
+    def claimed(self, tenant_id: str, planned: int, count: int):
+        """Record the outcome of a tenant's claim"""
+        self._in_flight[tenant_id] += count
+        if count < planned:
+            self._active.pop(tenant_id, None)
+    
+    def finished(self, tenant_id: str) -> bool:
+        """
+        Record a finished delivery
+
+        Returns:
+            True if the tenant was at its cap, so a slot may be claimable again
+        """
+        was_capped = self._headroom(tenant_id) <= 0
+        self._in_flight[tenant_id] -= 1
+        if self._in_flight[tenant_id] <= 0:
+            del self._in_flight[tenant_id]
+        return was_capped and tenant_id in self._active
+    
+    def __len__(self) -> int:
+        return len(self._active)
 
 class EventWorker:
     def __init__(self):
         self.running = False
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.clients = DestinationClients()
+        self.worker_id = _worker_id()
+        self.max_in_flight = max(1, settings.WORKER_MAX_IN_FLIGHT)
+        self.scheduler = FairScheduler()
+        self.breakers = CircuitBreakers()
+        # Destinations that accept arrays get their deliveries batched
+        self.batch_urls = set(settings.BATCH_DELIVERY_URLS)
+        self._batchers: Dict[str, DeliveryBatcher] = {}
+        # Tenants with retries scheduled by this process, keyed by due time
+        self.retries = DelayQueue()
+        self._in_flight = set()
+        self._in_flight_ids = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_scan = 0.0
+        # Where the next due-tenant scan continues, so every tenant is reached
+        # even when more than _TENANT_SCAN_LIMIT have due events
+        self._scan_cursor: Optional[str] = None
+        self._loop_task: Optional[asyncio.Task] = None
     
-    async def process_event(self, event_id: int):
-        """Process a single webhook event"""
-        db = SessionLocal()
+    async def _post(self, delivery: dict) -> DeliveryResult:
+        """Send one event on its own"""
+        url = delivery["url"]
         try:
-            # Get event from database
-            event = db.query(WebhookEvent).filter(WebhookEvent.id == event_id).first()
-            if not event:
-                return
-            
-            # Skip if already processed
-            if event.status in ["delivered", "failed"]:
-                return
-            
-            # Update status to processing
-            event.status = "processing"
-            db.commit()
-            
-            # Forward to internal URL
+            # Streamed so a large response body is never downloaded past the cap
+            async with self.clients.get(url).stream(
+                "POST",
+                url,
+                content=delivery["body"],
+                headers=_outbound_headers(delivery)
+            ) as response:
+                body = await read_prefix(response)
+        except Exception as e:
+            self._record_destination(url, False, delivery.get("probe", False))
+            return DeliveryResult.from_error(e)
+        # 4xx means the destination is up and rejected this event
+        self._record_destination(url, response.status_code < 500, delivery.get("probe", False))
+        return DeliveryResult.from_response(response, body)
+    
+    def _batcher(self, url: str) -> DeliveryBatcher:
+        batcher = self._batchers.get(url)
+        if batcher is None:
+            batcher = DeliveryBatcher(url, self.clients.get, self._record_destination)
+            self._batchers[url] = batcher
+        return batcher
+    
+    async def process_event(self, delivery: dict):
+        """Deliver one claimed event and record the outcome"""
+        event_id = delivery["event_id"]
+        
+        # Forward to internal URL, coalesced with other events if it takes arrays
+        # (a circuit breaker's probe always goes alone, so its outcome is its own)
+        if delivery["url"] in self.batch_urls and not delivery.get("probe"):
+            result = await self._batcher(delivery["url"]).submit(delivery)
+        else:
+            result = await self._post(delivery)
+        
+        if result.success:
+            # Success!
+            recorded = await run_in_session(
+                _record_success,
+                self.worker_id,
+                event_id,
+                delivery["attempt_number"],
+                result.status_code,
+                result.response_body
+            )
+            if recorded:
+                admission.record_completed(delivery["tenant_id"])
+            else:
+                _lease_lost(event_id)
+            return
+        
+        # Failed - will retry
+        recorded, delay = await run_in_session(
+            _record_failure,
+            self.worker_id,
+            event_id,
+            delivery["attempt_number"],
+            result.error,
+            result.status_code,
+            result.response_body,
+            delivery["signature"],
+            result.retry_after
+        )
+        
+        if not recorded:
+            _lease_lost(event_id)
+        elif delay is None:
+            # Dead-lettered, no longer part of the backlog
+            admission.record_completed(delivery["tenant_id"])
+        else:
+            # Persisted as next_attempt_at; the delay queue wakes the claim
+            # loop when it is due, and the poll finds it after a restart
+            self.retries.schedule(delivery["tenant_id"], delay)
+    
+    def _record_destination(self, url: str, healthy: bool, probe: bool = False):
+        if self.breakers.record(url, healthy, probe):
+            # Probe succeeded: rescan so tenants waiting on this destination resume
+            print(f"Circuit closed for {url}")
+            self.notify()
+    
+    def _start(self, delivery: dict):
+        """Run a claimed delivery as a task counted against the in-flight limits"""
+        task = asyncio.create_task(self._deliver(delivery))
+        self._in_flight.add(task)
+        self._in_flight_ids.add(delivery["event_id"])
+        task.add_done_callback(self._in_flight.discard)
+    
+    async def _send_probes(self):
+        """Send one delivery to each destination whose open period has passed"""
+        for url in self.breakers.probe_ready():
+            probe = await run_in_session(_claim_probe, self.worker_id, url)
+            breaker = self.breakers.get(url)
+            if probe is None:
+                # Nothing is due yet (failed events are waiting out their
+                # backoff); stay open so they can't all hit the destination
+                # at once, and look for a probe again shortly
+                breaker.wait_for_probe(min(settings.WORKER_POLL_INTERVAL, settings.CIRCUIT_OPEN_SECONDS))
+                continue
+            breaker.start_probe()
+            probe["probe"] = True
+            self.scheduler.claimed(probe["tenant_id"], 1, 1)
+            self._start(probe)
+    
+    async def _deliver(self, delivery: dict):
+        try:
+            await self.process_event(delivery)
+        except Exception as e:
+            print(f"Worker error delivering event {delivery['event_id']}: {e}")
+        finally:
+            self._in_flight_ids.discard(delivery["event_id"])
+            if self.scheduler.finished(delivery["tenant_id"]) and self._wakeup is not None:
+                self._wakeup.set()
+    
+    def notify(self, tenant_id: Optional[str] = None):
+        """
+        Wake the claim loop now; called when this process commits a new pending event
+
+        Without a tenant, the next claim rescans the database for due tenants.
+        A no-op unless this process runs the worker loop.
+        """
+        if not self.running:
+            return
+        if tenant_id is None:
+            self._next_scan = 0.0
+        else:
+            self.scheduler.activate(tenant_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def retry_loop(self):
+        """Wake the claim loop whenever a scheduled retry becomes due"""
+        while self.running:
+            tenant_id = await self.retries.next_due()
+            self.notify(tenant_id)
+    
+    async def heartbeat_loop(self):
+        """Keep the leases of in-flight deliveries from expiring"""
+        while self.running:
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_SECONDS)
+            event_ids = list(self._in_flight_ids)
             try:
-                response = await self.client.post(
-                    event.internal_url or settings.INTERNAL_WEBHOOK_URL,
-                    json=event.payload
-                )
-                
-                # Record attempt
-                attempt = EventAttempt(
-                    webhook_event_id=event_id,
-                    attempt_number=event.retry_count + 1,
-                    status="success" if response.is_success else "failed",
-                    response_code=response.status_code,
-                    response_body=response.text[:1000]
-                )
-                db.add(attempt)
-                
-                if response.is_success:
-                    # Success!
-                    event.status = "delivered"
-                    event.delivered_at = datetime.utcnow()
-                    db.commit()
-                    return
-                else:
-                    # Failed - will retry
-                    event.last_error = f"HTTP {response.status_code}: {response.text[:500]}"
-                    raise Exception(f"HTTP {response.status_code}")
-                    
+                for i in range(0, len(event_ids), _LEASE_BATCH):
+                    await run_in_session(
+                        _extend_leases, self.worker_id, event_ids[i:i + _LEASE_BATCH]
+                    )
             except Exception as e:
-                # Record failed attempt
-                attempt = EventAttempt(
-                    webhook_event_id=event_id,
-                    attempt_number=event.retry_count + 1,
-                    status="failed",
-                    error_message=str(e)[:1000]
-                )
-                db.add(attempt)
-                
-                event.retry_count += 1
-                event.last_error = str(e)[:500]
-                
-                # Exponential backoff retry
-                if event.retry_count < settings.MAX_RETRY_ATTEMPTS:
-                    # Calculate delay: 1s, 2s, 4s, 8s, 16s, 32s, 64s, 128s
-                    delay = settings.INITIAL_RETRY_DELAY * (2 ** (event.retry_count - 1))
-                    attempt.retry_delay = delay
-                    event.status = "pending"  # Reset to pending for retry
-                    db.commit()
-                    
-                    # Schedule retry
-                    await asyncio.sleep(delay)
-                    await self.process_event(event_id)
-                else:
-                    # Move to dead-letter queue
-                    event.status = "failed"
-                    db.commit()
-                    
-                    dead_letter = DeadLetterEvent(
-                        webhook_event_id=event_id,
-                        tenant_id=event.tenant_id,
-                        event_type=event.event_type,
-                        payload=event.payload,
-                        raw_body=event.raw_body,
-                        failure_reason=str(e)[:1000],
-                        retry_count=event.retry_count
+                print(f"Lease heartbeat error: {e}")
+    
+    async def reaper_loop(self):
+        """Periodically return events with expired leases to pending"""
+        while self.running:
+            try:
+                retried = dead_lettered = 0
+                while True:
+                    outcomes = await run_in_session(_reap_expired_leases, _LEASE_BATCH)
+                    for tenant_id, delay in outcomes:
+                        if delay is None:
+                            dead_lettered += 1
+                            admission.record_completed(tenant_id)
+                        else:
+                            retried += 1
+                            self.retries.schedule(tenant_id, delay)
+                    if len(outcomes) < _LEASE_BATCH:
+                        break
+                if retried or dead_lettered:
+                    print(
+                        f"Recovered {retried + dead_lettered} events with expired leases "
+                        f"({dead_lettered} out of attempts, dead-lettered)"
                     )
-                    db.add(dead_letter)
-                    db.commit()
-        
-        finally:
-            db.close()
+            except Exception as e:
+                print(f"Lease reaper error: {e}")
+            await asyncio.sleep(settings.WORKER_REAP_INTERVAL)
+    
+    async def _wait_for_work(self):
+        """
+        Sleep until notified (new event, due retry, freed tenant slot), the
+        next scan, or an open circuit's probe time
+
+        The scan is only a safety net for events written by other processes.
+        """
+        timeout = max(0.0, self._next_scan - asyncio.get_running_loop().time())
+        next_probe = self.breakers.next_probe_in()
+        if next_probe is not None:
+            timeout = min(timeout, next_probe)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
     
     async def worker_loop(self):
-        """Main worker loop that polls for pending events"""
+        """
+        Main worker loop: keep up to max_in_flight deliveries running
+
+        Free slots are refilled as soon as deliveries finish, split between
+        tenants by the fair scheduler; the loop only sleeps once no tenant
+        has anything claimable. Tenants enter the rotation when notified,
+        and from a database scan every poll interval.
+        """
         self.running = True
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.current_task()
         print("Event worker started")
+        background_tasks = [
+            asyncio.create_task(self.retry_loop()),
+            asyncio.create_task(self.heartbeat_loop()),
+            asyncio.create_task(self.reaper_loop())
+        ]
+        try:
+            await self._claim_loop()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+    
+    async def _claim_loop(self):
+        loop = asyncio.get_running_loop()
         
         while self.running:
             try:
-                db = SessionLocal()
-                try:
-                    # Get pending events (limit to 10 at a time)
-                    pending_events = db.query(WebhookEvent).filter(
-                        WebhookEvent.status == "pending"
-                    ).limit(10).all()
-                    
-                    # Process events concurrently
-                    tasks = [self.process_event(event.id) for event in pending_events]
-                    if tasks:
-                        await asyncio.gather(*tasks, return_exceptions=True)
+                if loop.time() >= self._next_scan:
+                    self._next_scan = loop.time() + settings.WORKER_POLL_INTERVAL
+                    tenants, self._scan_cursor = await run_in_session(
+                        _due_tenants, _TENANT_SCAN_LIMIT, self._scan_cursor
+                    )
+                    for tenant_id in tenants:
+                        self.scheduler.activate(tenant_id)
                 
-                finally:
-                    db.close()
+                free = self.max_in_flight - len(self._in_flight)
+                if free <= 0:
+                    await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
                 
-                # Wait before next poll
-                await asyncio.sleep(settings.WORKER_POLL_INTERVAL)
+                await self._send_probes()
+                free = self.max_in_flight - len(self._in_flight)
+                plan = self.scheduler.plan(free) if free > 0 else {}
+                if not plan:
+                    # Nothing due, or every tenant with due events is at its cap
+                    await self._wait_for_work()
+                    continue
+                
+                claimed = await run_in_session(
+                    _claim_for_tenants, self.worker_id, plan, self.breakers.blocked_urls()
+                )
+                if not self.running:
+                    # Stopped while claiming: drain() releases these
+                    break
+                for tenant_id, deliveries in claimed.items():
+                    self.scheduler.claimed(tenant_id, plan[tenant_id], len(deliveries))
+                    for delivery in deliveries:
+                        self._start(delivery)
             
             except Exception as e:
                 print(f"Worker error: {e}")
                 await asyncio.sleep(settings.WORKER_POLL_INTERVAL)
     
+    async def warm(self):
+        """Open connections to known destinations before the first delivery"""
+        await self.clients.warm([settings.INTERNAL_WEBHOOK_URL, *settings.DEST_WARM_URLS])
+    
     def stop(self):
         """Stop the worker"""
         self.running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def drain(self, timeout: Optional[float] = None):
+        """
+        Graceful shutdown: stop claiming and let in-flight deliveries finish
+
+        Deliveries still running after timeout (default WORKER_DRAIN_SECONDS)
+        are cancelled, and everything this worker still holds goes back to
+        pending in one update, so other workers pick it up immediately
+        instead of waiting for the leases to expire.
+        """
+        self.stop()
+        if timeout is None:
+            timeout = settings.WORKER_DRAIN_SECONDS
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        
+        pending = set(self._in_flight)
+        if self._loop_task is not None and self._loop_task is not asyncio.current_task():
+            pending.add(self._loop_task)
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            _, pending = await asyncio.wait(pending, timeout=remaining)
+            # Probes started while the loop was stopping
+            pending |= self._in_flight
+        
+        if pending:
+            print(f"Drain deadline passed; cancelling {len(pending)} tasks")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        released = await run_in_session(_release_claims, self.worker_id)
+        if released:
+            print(f"Released {released} undelivered events back to pending")
+        self._loop_task = None
+    
+    async def aclose(self):
+        """Flush delivery batches and close the destination connection pools"""
+        for batcher in self._batchers.values():
+            await batcher.stop()
+        await self.clients.aclose()
 
 # Global worker instance
 worker = EventWorker()
-
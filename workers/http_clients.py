@@ -0,0 +1,90 @@
+"""
+Per-destination HTTP connection pools for event delivery
+Each destination origin gets its own tuned httpx.AsyncClient, so a slow or
+busy destination can't exhaust the connections other destinations need
+"""
+import asyncio
+import sys
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+from config import settings
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (installed by httpx[http2])
+    except ImportError:
+        return False
+    return True
+
+def _origin(url: str) -> Tuple[str, str, Optional[int]]:
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname or "", parts.port
+
+class DestinationClients:
+    """
+    Lazily created AsyncClient per destination origin (scheme, host, port)
+
+    All pools share the DEST_* limits and timeouts. HTTP/2 is used when
+    DEST_HTTP2 is enabled and the h2 package is installed; otherwise
+    connections are HTTP/1.1 with keep-alive.
+    """
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        # transport overrides the network layer for every pool (e.g. a mock)
+        self.transport = transport
+        self.http2 = settings.DEST_HTTP2 and _http2_available()
+        if settings.DEST_HTTP2 and not self.http2:
+            print(
+                "Warning: DEST_HTTP2 is enabled but h2 is not installed; using HTTP/1.1.",
+                file=sys.stderr,
+            )
+        self.limits = httpx.Limits(
+            max_connections=settings.DEST_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.DEST_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.DEST_KEEPALIVE_EXPIRY
+        )
+        self.timeout = httpx.Timeout(
+            connect=settings.DEST_CONNECT_TIMEOUT,
+            read=settings.DEST_READ_TIMEOUT,
+            write=settings.DEST_WRITE_TIMEOUT,
+            pool=settings.DEST_POOL_TIMEOUT
+        )
+        self._clients: Dict[Tuple[str, str, Optional[int]], httpx.AsyncClient] = {}
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        """Client for the origin of url, creating its pool on first use"""
+        origin = _origin(url)
+        client = self._clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport
+            )
+            self._clients[origin] = client
+        return client
+
+    async def warm(self, urls: Iterable[str]):
+        """
+        Open a connection to each destination ahead of the first delivery
+
+        Sends a HEAD request; any response (even an error status) leaves a
+        keep-alive connection in the pool. Failures are only logged.
+        """
+        async def _warm_one(url: str):
+            try:
+                await self.get(url).head(url, timeout=settings.DEST_CONNECT_TIMEOUT)
+            except httpx.HTTPError as e:
+                print(f"Could not warm connection to {url}: {e}")
+
+        unique = {_origin(url): url for url in urls if url}
+        await asyncio.gather(*(_warm_one(url) for url in unique.values()))
+
+    async def aclose(self):
+        """Close every pool and its connections"""
+        clients, self._clients = list(self._clients.values()), {}
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._clients)
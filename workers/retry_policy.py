@@ -0,0 +1,87 @@
+"""
+Retry scheduling for failed deliveries
+Jittered exponential backoff so events that failed together don't retry
+together, with Retry-After from the destination taking precedence
+"""
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple, Optional
+from config import settings
+
+# Statuses whose Retry-After header says when the destination can take more
+RETRY_AFTER_STATUSES = (429, 503)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), None if absent or invalid"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class RetryPolicy(NamedTuple):
+    """
+    How long to wait before each retry, and how many attempts to make
+
+    none (or anything unrecognised): base * 2**(n-1), capped.
+    full: uniform between 0 and the capped exponential delay.
+    decorrelated: uniform between base and 3x the previous delay, capped.
+    """
+    base: float
+    cap: float
+    jitter: str
+    max_attempts: int
+
+    def delay(
+        self,
+        retry_count: int,
+        previous_delay: Optional[float] = None,
+        retry_after: Optional[float] = None
+    ) -> float:
+        """
+        Seconds until the next attempt after retry_count failures
+
+        A Retry-After from the destination is a lower bound, still limited by the cap.
+        """
+        exponential = min(self.cap, self.base * (2 ** max(0, retry_count - 1)))
+        if self.jitter == "full":
+            delay = random.uniform(0, exponential)
+        elif self.jitter == "decorrelated":
+            previous = previous_delay if previous_delay else self.base
+            delay = min(self.cap, random.uniform(self.base, max(self.base, previous * 3)))
+        else:
+            delay = exponential
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.cap))
+        return delay
+
+def _merge(policy: RetryPolicy, overrides: Optional[dict]) -> RetryPolicy:
+    if not overrides:
+        return policy
+    return policy._replace(**{
+        field: overrides[field] for field in RetryPolicy._fields if field in overrides
+    })
+
+def retry_policy_for(tenant_id: Optional[str], url: Optional[str]) -> RetryPolicy:
+    """
+    Policy for an event: the global settings, then the destination's
+    overrides (RETRY_POLICY_DESTINATIONS), then the tenant's (RETRY_POLICY_TENANTS)
+    """
+    policy = RetryPolicy(
+        base=settings.INITIAL_RETRY_DELAY,
+        cap=settings.MAX_RETRY_DELAY,
+        jitter=settings.RETRY_JITTER,
+        max_attempts=settings.MAX_RETRY_ATTEMPTS
+    )
+    policy = _merge(policy, settings.RETRY_POLICY_DESTINATIONS.get(url or settings.INTERNAL_WEBHOOK_URL))
+    return _merge(policy, settings.RETRY_POLICY_TENANTS.get(tenant_id or "default"))
@@ -0,0 +1,25 @@
+"""
+Delivery worker process body, shared by every process `python -m workers` starts
+"""
+import asyncio
+import signal
+from workers.event_worker import worker
+
+async def serve():
+    """Run one worker until SIGTERM/SIGINT"""
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_requested.set)
+
+    await worker.warm()
+    asyncio.create_task(worker.worker_loop())
+    await stop_requested.wait()
+
+    # Finishes or releases everything claimed, so a restart loses no work
+    await worker.drain()
+    await worker.aclose()
+
+def run_process():
+    """Process entry point (importable, so spawned processes can find it)"""
+    asyncio.run(serve())